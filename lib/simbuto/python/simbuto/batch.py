@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+# system modules
+import os
+import glob
+import logging
+import configparser
+import concurrent.futures
+
+# internal modules
+from . import manager
+from .config import install_language_globally
+
+# the manager of a worker process
+_manager = None
+
+def budget_files(paths, pattern = "*.simbuto"):
+    """ Expand directories to the budget files in them
+    Args:
+        paths (list of path): files and directories
+        pattern [Optional(str)]: the glob pattern of budget files in
+            directories. Defaults to '*.simbuto'.
+    Returns:
+        files (list of path): the budget files
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, pattern))))
+        else:
+            files.append(path)
+    return files
+
+def output_path(filename, directory, extension):
+    """ The path of an output file for a budget file
+    Args:
+        filename (path): the budget file
+        directory (path or None): the output directory. None means the
+            directory of the budget file.
+        extension (str): the extension of the output file
+    Returns:
+        path (str): the output file path
+    """
+    base = os.path.splitext(os.path.basename(filename))[0]
+    if directory is None:
+        directory = os.path.dirname(filename)
+    return os.path.join(directory, "{}.{}".format(base, extension))
+
+def init_worker(config, loglevel = logging.WARNING):
+    """ Set up the manager of a worker process
+    Args:
+        config (dict): the configuration as dict of sections
+        loglevel [Optional(int)]: the log level. Defaults to logging.WARNING.
+    """
+    global _manager
+    install_language_globally() # a spawned process doesn't have _()
+    parser = configparser.ConfigParser()
+    parser.read_dict(config)
+    logger = logging.getLogger(__name__)
+    if not logger.handlers:
+        logger.addHandler(logging.StreamHandler())
+    logger.setLevel(loglevel)
+    _manager = manager.SimbutoManager()
+    _manager.logger = logger
+    _manager.set_config(parser)
+
+def render_budget(filename, directory = None, formats = ("png",),
+    width = 600, height = 400, scenarios = None, **options):
+    """ Simulate one budget file and write the outputs. This runs in a worker
+    process set up with init_worker.
+    Args:
+        filename (path): the budget file
+        directory [Optional(path)]: the output directory. Defaults to the
+            directory of the budget file.
+        formats [Optional(sequence of str)]: the output formats, 'png',
+            'csv', 'forecast' and/or 'scenarios'. Defaults to png only.
+        width, height [Optional(int)]: the png size in pixels. Defaults to
+            600x400.
+        scenarios [Optional(list of dict)]: the variants for the
+            'scenarios' format, see SimbutoManager.sweep_scenarios
+        options (keyword arguments): further arguments for
+            SimbutoManager.create_timeseries_from_text like start, end,
+            opening_stock, ensemble_size, use_ensemble and resolution
+    Returns:
+        outputs (list of path): the written files. Empty if nothing worked.
+    """
+    text = _manager.read_text_from_file(filename)
+    if text is None:
+        return []
+    timeseries = _manager.create_timeseries_from_text(text = text, **options)
+    if timeseries is None:
+        return []
+    outputs = []
+    for extension in formats:
+        path = output_path(filename, directory, extension)
+        if extension == "png":
+            if _manager.daemon_client is not None: # R runs in the daemon
+                success = _manager.create_png_graph_from_text(text = text,
+                    filename = path, width = width, height = height,
+                    **options)
+            else:
+                success = _manager.plot_timeseries_to_png(filename = path,
+                    timeseries = timeseries, width = width, height = height)
+        elif extension == "csv":
+            success = _manager.save_timeseries_to_csv(filename = path,
+                timeseries = timeseries)
+        elif extension == "forecast":
+            success = _manager.write_forecast(filename = path,
+                timeseries = timeseries, budget = os.path.abspath(filename))
+        elif extension == "scenarios":
+            path = output_path(filename, directory, "scenarios.csv")
+            results = _manager.sweep_scenarios(text = text,
+                scenarios = scenarios or [], **{key: value
+                    for key, value in options.items() if key in ("start",
+                    "end", "opening_stock", "use_ensemble")})
+            success = results is not None and \
+                _manager.save_scenarios_to_csv(filename = path,
+                    results = results)
+        else:
+            raise ValueError(_("Unknown output format '{}'").format(extension))
+        if success:
+            outputs.append(path)
+    return outputs
+
+def render_budgets(files, config, jobs = None, loglevel = logging.WARNING,
+    **kwargs):
+    """ Render many budget files in parallel worker processes. Every process
+    starts its own R.
+    Args:
+        files (list of path): the budget files
+        config (configparser.ConfigParser): the configuration
+        jobs [Optional(int)]: the number of worker processes. Defaults to the
+            number of CPUs.
+        loglevel [Optional(int)]: the log level of the workers. Defaults to
+            logging.WARNING.
+        kwargs (keyword arguments): further arguments for render_budget
+    Yields:
+        filename, outputs (path, list of path): the budget file and the
+            written files as soon as a file is done
+    """
+    config = {name: dict(section) for name, section in config.items()}
+    with concurrent.futures.ProcessPoolExecutor(max_workers = jobs,
+        initializer = init_worker, initargs = (config, loglevel)) as pool:
+        futures = {pool.submit(render_budget, filename, **kwargs): filename
+            for filename in files}
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                outputs = future.result()
+            except Exception as e:
+                logging.getLogger(__name__).warning(
+                    _("Rendering '{}' failed: {}").format(futures[future], e))
+                outputs = []
+            yield futures[future], outputs
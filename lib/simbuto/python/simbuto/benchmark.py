@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+""" Benchmark the simbuto stages on synthetic budgets
+
+After running make, call it from the source tree like
+
+    PYTHONPATH=lib/simbuto/python python3 -m simbuto.benchmark \\
+        --facts 10 1000 100000 --years 1 30 --ensemble-size 0 1000
+
+Every run appends one JSON object per line to the output file. With
+--validate, the analytic ensemble mode is checked against large Monte Carlo
+ensembles instead and the exit status tells whether it agrees.
+"""
+# system modules
+import os
+import sys
+import json
+import time
+import argparse
+import datetime
+import platform
+import resource
+import tempfile
+import tracemalloc
+import configparser
+
+# external modules
+import numpy as np
+
+# internal modules
+from . import engine
+from .budget import BudgetModel
+from . import VERSION
+
+# the frequencies of the synthetic facts
+FREQUENCIES = ["once", "daily", "weekly", "monthly", "yearly"]
+
+
+def generate_budget(facts, start = None, years = 1, tolerances = True,
+    seed = None):
+    """ Generate a synthetic simbuto budget
+    Args:
+        facts (int): the number of facts
+        start [Optional(datetime.date)]: the earliest fact start. Defaults to
+            today.
+        years [Optional(int)]: the facts start and end within this many years
+            from the start. Defaults to 1.
+        tolerances [Optional(bool)]: give half of the facts tolerances?
+            Defaults to True.
+        seed [Optional(int)]: the random seed. Defaults to None.
+    Returns:
+        text (str): the budget text
+    """
+    if start is None: start = datetime.date.today()
+    rng = np.random.default_rng(seed)
+    days = int(years * 365.25)
+    start = np.datetime64(start, "D")
+    lines = ["title;frequency;start;end;amount;tolerance_day;tolerance_amount"]
+    for i in range(facts):
+        frequency = FREQUENCIES[i % len(FREQUENCIES)]
+        first = start + int(rng.integers(0, max(days // 10, 1)))
+        last = first + int(rng.integers(days // 2, days + 1))
+        # mostly small costs, some larger incomes
+        if rng.random() < 0.8:
+            amount = -round(float(rng.lognormal(3, 1)), 2)
+        else:
+            amount = round(float(rng.lognormal(6, 1)), 2)
+        if tolerances and i % 2:
+            tolerance_day = int(rng.integers(0, 8))
+            tolerance_amount = round(abs(amount) * rng.random() * 0.2, 2)
+        else:
+            tolerance_day, tolerance_amount = "", ""
+        lines.append(";".join(map(str, ("fact {}".format(i), frequency,
+            first, "" if frequency == "once" else last, amount,
+            tolerance_day, tolerance_amount))))
+    return "\n".join(lines) + "\n"
+
+def measure(function, *args, reset = None, trace = True, **kwargs):
+    """ Run a function and measure it. The function is called twice: once
+    timed and once with tracemalloc, which slows allocations down unevenly.
+    Args:
+        function (callable): the function
+        args, kwargs: the arguments for the function
+        reset [Optional(callable)]: called before both calls to restore the
+            state the function changes, so that both calls do the same work.
+            Defaults to None.
+        trace [Optional(bool)]: make the second call? Defaults to True.
+    Returns:
+        result, stats (object, dict): the result of the timed call and the
+            'seconds', the 'peak_bytes' of Python and NumPy allocations during
+            the second call (None without trace) and the process-wide
+            'maxrss_kib'
+    """
+    if reset is not None:
+        reset()
+    time_before = time.perf_counter()
+    result = function(*args, **kwargs)
+    seconds = time.perf_counter() - time_before
+    peak = None
+    if trace:
+        if reset is not None:
+            reset()
+        tracemalloc.start()
+        try:
+            function(*args, **kwargs)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return result, {"seconds": seconds, "peak_bytes": peak,
+        "maxrss_kib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}
+
+def benchmark(manager, facts, years, ensemble_size, tolerances = True,
+    plot = False, seed = 1, trace = True):
+    """ Benchmark all stages for one budget size
+    Args:
+        manager (SimbutoManager): the configured manager
+        facts (int): the number of facts
+        years (int): the horizon in years
+        ensemble_size (int): the ensemble size, 0 means no ensemble
+        tolerances [Optional(bool)]: generate tolerances? Defaults to True.
+        plot [Optional(bool)]: also benchmark plotting with R? Defaults to
+            False.
+        seed [Optional(int)]: the seed of the generator. Defaults to 1.
+        trace [Optional(bool)]: also measure the allocation peaks of the
+            stages? That runs every stage twice. Defaults to True.
+    Returns:
+        stages (dict): the measurements per stage, a failed stage is None
+    """
+    start = datetime.datetime.now()
+    end = start + datetime.timedelta(days = int(years * 365.25))
+    text = generate_budget(facts, start = start.date(), years = years,
+        tolerances = tolerances, seed = seed)
+    stages = {}
+    budget, stages["read"] = measure(engine.read_budget_from_text, text,
+        trace = trace)
+    # commenting out a line in the middle only parses that line again
+    model = BudgetModel(text)
+    result, stages["reparse"] = measure(model.insert,
+        len(model.lines) // 2, 0, "#", reset = lambda: model.set_text(text),
+        trace = trace)
+    # the manager parses the whole budget for the first simulation and only
+    # reuses it afterwards
+    def parsed(current):
+        return lambda: manager.budget_model.set_text(current)
+    timeseries, stages["timeseries"] = measure(
+        manager.create_timeseries_from_text, text = text, start = start,
+        end = end, reset = parsed(""), trace = trace)
+    if timeseries is None:
+        stages["timeseries"] = None
+    # 50 variants of opening stock and tolerances of the parsed budget
+    scenarios = [{"opening_stock": 100 * i, "tolerance_scale": 1 + i % 5 / 4}
+        for i in range(50)]
+    results, stages["sweep"] = measure(manager.sweep_scenarios, text = text,
+        scenarios = scenarios, start = start, end = end,
+        use_ensemble = ensemble_size > 0, reset = parsed(text),
+        trace = trace)
+    if results is None:
+        stages["sweep"] = None
+    if ensemble_size > 0:
+        timeseries, stages["ensemble"] = measure(
+            manager.create_timeseries_from_text, text = text, start = start,
+            end = end, ensemble_size = ensemble_size, use_ensemble = True,
+            reset = parsed(text), trace = trace)
+        if timeseries is None:
+            stages["ensemble"] = None
+    if plot and timeseries is not None:
+        with tempfile.TemporaryDirectory() as directory:
+            success, stages["plot"] = measure(manager.plot_timeseries_to_png,
+                filename = os.path.join(directory, "graph.png"),
+                timeseries = timeseries, trace = trace)
+        if not success:
+            stages["plot"] = None
+    return stages
+
+def validate_analytic(facts, years, ensemble_size = 10000, seed = 1,
+    tolerance = 5, approximation_tolerance = 1):
+    """ Compare the analytic ensemble mode to a large Monte Carlo ensemble
+    with a fixed seed. The exact cumulants are compared to the sample
+    cumulants in standard errors of the Monte Carlo estimates, so the
+    tolerance doesn't depend on the ensemble size. The quantiles follow from
+    the cumulants with the Cornish-Fisher expansion, which is only an
+    approximation. On days within the day tolerance of a large occurence the
+    ensemble is far from normal, so its deviation from the sample quantiles
+    is bounded in units of the largest standard deviation.
+    Args:
+        facts (int): the number of facts
+        years (int): the horizon in years
+        ensemble_size [Optional(int)]: the Monte Carlo ensemble size.
+            Defaults to 10000.
+        seed [Optional(int)]: the seed of the generator and the ensemble.
+            Defaults to 1.
+        tolerance [Optional(float)]: the maximum allowed deviation of the
+            cumulants in standard errors. Defaults to 5.
+        approximation_tolerance [Optional(float)]: the maximum allowed
+            deviation of the quantiles in units of the largest standard
+            deviation. Defaults to 1.
+    Returns:
+        validation (dict): the maximum deviations in standard errors of the
+            'mean', the 'variance' and the 'third' and 'fourth' cumulants,
+            the maximum deviation of the quantiles from the sample quantiles
+            in units of the largest standard deviation
+            ('ensquant05_approximation' and 'ensquant95_approximation') and
+            whether all deviations are within the tolerances ('ok')
+    """
+    start = datetime.date.today()
+    end = start + datetime.timedelta(days = int(years * 365.25))
+    budget = engine.read_budget_from_text(generate_budget(facts,
+        start = start, years = years, seed = seed), today = start)
+    start, end = np.datetime64(start, "D"), np.datetime64(end, "D")
+    N = int((end - start).astype(int)) + 1
+    occuring = engine.budget_facts(budget, start, end)
+    cumulants = engine.analytic_cumulants(occuring, N)
+    ensemble = engine.ensemble_members(occuring, ensemble_size, N,
+        np.random.default_rng(seed))
+    timeseries = engine.timeseries_from_budget(budget, start, end,
+        ensemble_size = ensemble_size, ensemble_mode = "analytic")
+    sample_mean = ensemble.mean(axis = 0)
+    d = ensemble - sample_mean
+    m2, m3, m4 = [(d ** k).mean(axis = 0) for k in (2, 3, 4)]
+    # the sample cumulants and their influence functions, whose standard
+    # deviations give the standard errors
+    samples = {
+        "mean": (sample_mean, d),
+        "variance": (m2, d ** 2),
+        "third": (m3, d ** 3 - 3 * m2 * d),
+        "fourth": (m4 - 3 * m2 ** 2, d ** 4 - 4 * m3 * d - 6 * m2 * d ** 2),
+        }
+    # days without any uncertainty have to match exactly
+    variance = cumulants[1]
+    varying = variance > 1e-9 * max(np.abs(cumulants[0]).max(), 1)
+    exact = np.allclose(sample_mean[~varying], cumulants[0][~varying])
+    validation = {}
+    for (name, (sample, influence)), cumulant in zip(samples.items(),
+        cumulants):
+        error = influence.std(axis = 0) / np.sqrt(ensemble_size)
+        validation[name] = float(np.abs((sample - cumulant)[varying]
+            / error[varying]).max()) if varying.any() else 0.0
+    scale = max(np.sqrt(variance.max()), 1)
+    for name, q in (("ensquant05", 0.05), ("ensquant95", 0.95)):
+        validation[name + "_approximation"] = float(np.abs(timeseries[name]
+            - np.quantile(ensemble, q, axis = 0)).max() / scale)
+    validation["ok"] = bool(exact
+        and max(validation[name] for name in samples) <= tolerance
+        and max(validation["ensquant05_approximation"],
+            validation["ensquant95_approximation"])
+            <= approximation_tolerance)
+    return validation
+
+def main(args = None):
+    """ Run the benchmark from the command line
+    Args:
+        args [Optional(list of str)]: the command-line arguments. Defaults to
+            sys.argv.
+    """
+    import builtins
+    if not hasattr(builtins, "_"): # no translation installed
+        builtins._ = lambda s: s
+    from . import manager as simbutomanager
+
+    argparser = argparse.ArgumentParser(
+        description = "Benchmark simbuto on synthetic budgets")
+    argparser.add_argument("--facts", type=int, nargs="+",
+        default=[10, 100, 1000, 10000, 100000])
+    argparser.add_argument("--years", type=int, nargs="+", default=[1, 10, 30])
+    argparser.add_argument("--ensemble-size", type=int, nargs="+",
+        default=[0, 100, 1000, 10000])
+    argparser.add_argument("--backend", choices=["numpy","r"],
+        default="numpy")
+    argparser.add_argument("--resolution", choices=["day","week","month"],
+        default="day", help="the resolution of the forecasts")
+    argparser.add_argument("--no-tolerances", action="store_true")
+    argparser.add_argument("--plot", action="store_true",
+        help="also benchmark plotting with R")
+    argparser.add_argument("--no-trace", action="store_true",
+        help="only time the stages without their allocation peaks, which "
+        "runs every stage once instead of twice")
+    argparser.add_argument("--repeat", type=int, default=1)
+    argparser.add_argument("--validate", action="store_true",
+        help="compare the analytic ensemble mode to Monte Carlo runs with the "
+        "largest ensemble size instead of benchmarking")
+    argparser.add_argument("-o", "--output", default="benchmark.jsonl",
+        help="the JSON lines file to append to, '-' for stdout")
+    args = argparser.parse_args(args)
+
+    config = configparser.ConfigParser()
+    # no caches, every run should simulate everything
+    config.read_dict({"engine": {"backend": args.backend, "cache_size": "0",
+        "forecast_cache_size": "0", "resolution": args.resolution}})
+    manager = simbutomanager.SimbutoManager()
+    manager.set_config(config)
+    if args.plot or args.backend == "r":
+        manager.ensure_started() # don't measure the R startup
+
+    output = sys.stdout if args.output == "-" else open(args.output, "a")
+    try:
+        if args.validate:
+            failed = False
+            for facts in args.facts:
+                for years in args.years:
+                    validation = validate_analytic(facts = facts,
+                        years = years, ensemble_size = max(args.ensemble_size))
+                    failed = failed or not validation["ok"]
+                    output.write(json.dumps({"facts": facts, "years": years,
+                        "ensemble_size": max(args.ensemble_size),
+                        "validation": validation}) + "\n")
+            sys.exit(1 if failed else 0)
+        for facts in args.facts:
+            for years in args.years:
+                for ensemble_size in args.ensemble_size:
+                    for repetition in range(args.repeat):
+                        stages = benchmark(manager, facts = facts,
+                            years = years, ensemble_size = ensemble_size,
+                            tolerances = not args.no_tolerances,
+                            plot = args.plot, trace = not args.no_trace)
+                        record = {
+                            "time": datetime.datetime.now().isoformat(),
+                            "version": VERSION,
+                            "python": platform.python_version(),
+                            "numpy": np.__version__,
+                            "host": platform.node(),
+                            "backend": args.backend,
+                            "resolution": args.resolution,
+                            "facts": facts, "years": years,
+                            "ensemble_size": ensemble_size,
+                            "tolerances": not args.no_tolerances,
+                            "repetition": repetition,
+                            "stages": stages,
+                            }
+                        output.write(json.dumps(record) + "\n")
+                        output.flush()
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+if __name__ == "__main__":
+    main()
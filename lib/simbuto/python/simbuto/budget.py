@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+# system modules
+import csv
+import collections
+
+# external modules
+import numpy as np
+
+# internal modules
+from . import engine
+from . import recurrence
+from . import WithLogger
+
+# a parsed budget line: the budget fact and the list of error messages
+ParsedLine = collections.namedtuple("ParsedLine", ["fact", "errors"])
+
+
+def split_fields(line):
+    """ Split a budget line into its fields like read.csv2 would
+    Args:
+        line (str): the line without comment
+    Returns:
+        fields (list of str): the fields
+    """
+    return next(csv.reader([line], delimiter=";", quotechar='"'), [])
+
+def line_errors(header, row, fact):
+    """ Check a parsed budget line
+    Args:
+        header (list of str): the column names
+        row (list of str): the fields of the line
+        fact (dict): the budget fact from engine.fact_from_fields
+    Returns:
+        errors (list of str): the error messages, empty if the line is fine
+    """
+    errors = []
+    if len(row) > len(header): # missing fields at the end are empty
+        errors.append(_("expected at most {} fields but got {}").format(
+            len(header), len(row)))
+    fields = dict(zip(header, row))
+    try:
+        recurrence.parse_rule(fact["frequency"])
+    except ValueError as e:
+        errors.append(str(e))
+    if np.isnan(fact["amount"]):
+        errors.append(_("invalid amount '{}'").format(
+            fields.get("amount","")))
+    for name in ("start", "end"):
+        if np.isnat(fact[name]) and fields.get(name,"").strip():
+            errors.append(_("invalid {} date '{}'").format(name,
+                fields[name]))
+    for name in ("tolerance_day", "tolerance_amount"):
+        if np.isnan(fact[name]) and fields.get(name,"").strip():
+            errors.append(_("invalid {} '{}'").format(name, fields[name]))
+    if np.isnat(fact["skip"]).any():
+        errors.append(_("invalid skip dates '{}'").format(fields["skip"]))
+    return errors
+
+
+class BudgetModel(WithLogger):
+    """ A budget that is parsed once and then kept up to date line by line.
+    Edits are applied with insert() and delete(), e.g. from the insert-text
+    and delete-range signals of a Gtk.TextBuffer, or with set_text(), which
+    only parses the lines that differ from the current text. Lines are
+    separated by newlines and positions are character offsets within a line
+    like Gtk.TextIter.get_line_offset(). Every line is a fact on its own,
+    quoted fields can't span lines.
+    """
+    def __init__(self, text = ""):
+        """ class constructor
+        Args:
+            text [Optional(str)]: the csv-like simbuto budget. Defaults to an
+                empty budget.
+        """
+        self.lines = [""]
+        self.parsed = [None]
+        self.header = None
+        self.header_line = None
+        self.revision = 0
+        self.set_text(text)
+
+    ### properties ###
+    @property
+    def text(self):
+        """ The whole budget text
+        """
+        try:
+            return self._text
+        except AttributeError:
+            self._text = "\n".join(self.lines)
+            return self._text
+
+    @property
+    def facts(self):
+        """ The budget facts of all lines in order
+        """
+        return [p.fact for p in self.parsed if p is not None]
+
+    @property
+    def errors(self):
+        """ The errors of all lines as list of (line number, message), the
+        line numbers start at 1
+        """
+        return [(i + 1, error) for i, p in enumerate(self.parsed)
+            if p is not None for error in p.errors]
+
+    @property
+    def table(self):
+        """ The budget facts as typed columns: 'line' (the line number),
+        'title', 'frequency', 'amount', 'start', 'end', 'tolerance_day',
+        'tolerance_amount' and 'skip' (arrays of dates). Rebuilt after changes
+        only when requested.
+        """
+        try:
+            return self._table
+        except AttributeError:
+            lines = [i + 1 for i, p in enumerate(self.parsed) if p is not None]
+            facts = self.facts
+            def column(name, dtype):
+                return np.array([f[name] for f in facts], dtype = dtype)
+            self._table = {
+                "line": np.array(lines, dtype = int),
+                "title": column("title", object),
+                "frequency": column("frequency", object),
+                "amount": column("amount", float),
+                "start": column("start", "datetime64[D]"),
+                "end": column("end", "datetime64[D]"),
+                "tolerance_day": column("tolerance_day", float),
+                "tolerance_amount": column("tolerance_amount", float),
+                "skip": np.array([None] * len(facts), dtype = object),
+                }
+            self._table["skip"][:] = [f["skip"] for f in facts]
+            return self._table
+
+    ### methods ###
+    def budget(self, opening_stock = 0, today = None):
+        """ The budget like engine.read_budget_from_text returns it
+        Args:
+            opening_stock [Optional(float)]: The opening stock. Defaults to 0.
+            today [Optional(datetime.date)]: the day of the opening stock.
+                Defaults to the current day.
+        Returns:
+            budget (list of dict): the budget facts, the opening stock first
+        """
+        return [engine.opening_stock_fact(opening_stock, today)] + self.facts
+
+    def find_header(self):
+        """ Find the header, the first line that is not blank or a comment
+        Returns:
+            index, header (int, list of str): the index of the header line and
+                the column names. None, None if there is no header.
+        """
+        for i, line in enumerate(self.lines):
+            line = engine.strip_comment(line.rstrip("\r"))
+            if line.strip():
+                return i, [h.strip() for h in split_fields(line)]
+        return None, None
+
+    def parse_line(self, index):
+        """ Parse a single line with the current header
+        Args:
+            index (int): the index of the line
+        Returns:
+            parsed (ParsedLine or None): the parsed line, None for the header,
+                blank lines and comments
+        """
+        if index == self.header_line:
+            return None
+        line = engine.strip_comment(self.lines[index].rstrip("\r"))
+        if not line.strip():
+            return None
+        row = split_fields(line)
+        fact = engine.fact_from_fields(dict(zip(self.header, row)))
+        return ParsedLine(fact, line_errors(self.header, row, fact))
+
+    def replace_lines(self, first, stop, lines):
+        """ Replace a range of lines and parse only the new lines. Everything
+        is parsed again if the header changed.
+        Args:
+            first, stop (int): the range of lines to replace like a slice
+            lines (list of str): the new lines
+        """
+        self.lines[first:stop] = lines
+        stop_new = first + len(lines)
+        old_header_line = self.header_line
+        if old_header_line is None or first <= old_header_line:
+            header_line, header = self.find_header()
+        else: # the header is before the edit
+            header_line, header = self.header_line, self.header
+        self.header_line = header_line
+        if header != self.header:
+            self.logger.debug(_("Budget header changed, parsing everything"))
+            self.header = header
+            self.parsed = [self.parse_line(i) for i in range(len(self.lines))]
+        else:
+            self.parsed[first:stop] = [self.parse_line(i)
+                for i in range(first, stop_new)]
+            # the header line might have moved to a line outside the edit
+            if old_header_line is not None and old_header_line >= first:
+                old_header_line = old_header_line + stop_new - stop \
+                    if old_header_line >= stop else None
+            for i in (old_header_line, header_line):
+                if i is not None and not first <= i < stop_new:
+                    self.parsed[i] = self.parse_line(i)
+        self.revision += 1
+        for attr in ("_text", "_table"):
+            try: delattr(self, attr)
+            except AttributeError: pass
+
+    def insert(self, line, offset, text):
+        """ Insert text
+        Args:
+            line, offset (int): the position to insert at
+            text (str): the inserted text
+        """
+        current = self.lines[line]
+        self.replace_lines(line, line + 1,
+            (current[:offset] + text + current[offset:]).split("\n"))
+
+    def delete(self, start_line, start_offset, end_line, end_offset):
+        """ Delete a range of text
+        Args:
+            start_line, start_offset (int): the first deleted position
+            end_line, end_offset (int): the position after the deleted text
+        """
+        self.replace_lines(start_line, end_line + 1,
+            [self.lines[start_line][:start_offset] +
+                self.lines[end_line][end_offset:]])
+
+    def set_text(self, text):
+        """ Replace the whole text, but only parse the lines in between the
+        unchanged first and last lines
+        Args:
+            text (str): the csv-like simbuto budget
+        """
+        lines = text.split("\n")
+        if lines == self.lines:
+            return
+        size = min(len(lines), len(self.lines))
+        prefix = 0
+        while prefix < size and lines[prefix] == self.lines[prefix]:
+            prefix += 1
+        suffix = 0
+        while suffix < size - prefix and \
+            lines[-1 - suffix] == self.lines[-1 - suffix]:
+            suffix += 1
+        self.replace_lines(prefix, len(self.lines) - suffix,
+            lines[prefix:len(lines) - suffix])
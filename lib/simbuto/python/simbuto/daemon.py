@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+""" A long-lived forecast service on a local Unix socket
+
+The daemon keeps one SimbutoManager with a started R, the parsed budget, the
+fact cache and the stored forecasts warm for all clients. A client sends one
+JSON object per line and gets one JSON object per line back on the same
+connection, either {"ok": true, "result": ...} or {"ok": false, "error":
+"..."}. The commands are
+
+ping
+    the version, process id and backend of the daemon
+timeseries
+    the forecast of a budget 'text' or 'path' with 'start', 'end'
+    (YYYY-MM-DD), 'opening_stock', 'ensemble_size', 'use_ensemble' and
+    'resolution' like SimbutoManager.create_timeseries_from_text. The result
+    has the columns of the timeseries, 'day' as YYYY-MM-DD strings, or is
+    null if the simulation failed.
+png
+    the same inputs plus 'filename', 'width' and 'height', the daemon writes
+    the graph to the file. The result is true if that worked.
+
+Budgets and png files are read and written by the daemon, so it has to run
+as the same user on the same machine as its clients.
+"""
+# system modules
+import os
+import json
+import socket
+import datetime
+import threading
+import socketserver
+
+# external modules
+import numpy as np
+
+# internal modules
+from .config import personal_simbuto_dotfolder
+from . import VERSION
+from . import WithLogger
+
+# the socket in the personal dotfolder
+DEFAULT_SOCKET = "daemon.sock"
+
+
+class DaemonError(Exception):
+    """ The daemon could not handle a request """
+
+
+def socket_path(config = None):
+    """ The path of the daemon socket
+    Args:
+        config [Optional(configparser.ConfigParser)]: the configuration with
+            the socket in the [daemon] section
+    Returns:
+        path (str): the socket path. Defaults to daemon.sock in the personal
+            dotfolder.
+    """
+    path = ""
+    if config is not None:
+        path = config.get("daemon","socket",fallback="").strip()
+    if not path:
+        path = os.path.join(personal_simbuto_dotfolder(), DEFAULT_SOCKET)
+    return os.path.expanduser(path)
+
+def encode_timeseries(timeseries):
+    """ Convert a timeseries to JSON-serializable lists
+    Args:
+        timeseries (dict of numpy.ndarray or None): the timeseries
+    Returns:
+        columns (dict of list or None): 'day' as YYYY-MM-DD strings and the
+            series as floats
+    """
+    if timeseries is None:
+        return None
+    return {name: np.asarray(values, dtype = "datetime64[D]").astype(str
+        ).tolist() if name == "day" else np.asarray(values, dtype = float
+        ).tolist() for name, values in timeseries.items()}
+
+def decode_timeseries(columns):
+    """ Convert the result of encode_timeseries back
+    Args:
+        columns (dict of list or None): the encoded timeseries
+    Returns:
+        timeseries (dict of numpy.ndarray or None): the timeseries
+    """
+    if columns is None:
+        return None
+    return {name: np.array(values, dtype = "datetime64[D]"
+        if name == "day" else float) for name, values in columns.items()}
+
+def parse_date(string):
+    """ Parse a YYYY-MM-DD date of a request
+    Args:
+        string (str): the date
+    Returns:
+        date (datetime.datetime): the date
+    Raises:
+        ValueError: if the date is invalid
+    """
+    return datetime.datetime.strptime(string, "%Y-%m-%d")
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    """ Answer the requests of one client connection line by line
+    """
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line.decode("utf-8"))
+                response = {"ok": True,
+                    "result": self.server.handle_request(**request)}
+            except Exception as e: # any failure goes back to the client
+                self.server.logger.warning(_("Request failed: {}").format(e))
+                response = {"ok": False, "error": str(e)}
+            self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+            self.wfile.flush()
+
+
+class ForecastDaemon(socketserver.ThreadingMixIn,
+    socketserver.UnixStreamServer, WithLogger):
+    """ The forecast service. Every client connection gets its own thread but
+    the simulations run one at a time, R and the caches of the manager are
+    not thread-safe.
+    """
+    daemon_threads = True
+
+    def __init__(self, manager, path):
+        """ class constructor
+        Args:
+            manager (SimbutoManager): the manager to answer the requests
+                with, it must not use a daemon itself
+            path (path): the socket path. A stale socket file is removed.
+        Raises:
+            DaemonError: if another daemon already listens on the socket
+        """
+        self.manager = manager
+        self.lock = threading.Lock()
+        if os.path.exists(path):
+            try:
+                DaemonClient(path, timeout = 1).request("ping")
+            except (OSError, DaemonError):
+                os.unlink(path) # nobody listens anymore
+            else:
+                raise DaemonError(_("a daemon is already listening on "
+                    "'{}'").format(path))
+        # the socket is only for this user from the start
+        umask = os.umask(0o177)
+        try:
+            socketserver.UnixStreamServer.__init__(self, path,
+                RequestHandler)
+        finally:
+            os.umask(umask)
+
+    ### methods ###
+    def handle_request(self, command, **args):
+        """ Answer a request
+        Args:
+            command (str): 'ping', 'timeseries' or 'png'
+            args (keyword arguments): the arguments of the command
+        Returns:
+            result (JSON-serializable): the result of the command
+        Raises:
+            ValueError: if the command or its arguments are invalid
+        """
+        if command == "ping":
+            return {"version": VERSION, "pid": os.getpid(),
+                "backend": self.manager.backend}
+        if command not in ("timeseries", "png"):
+            raise ValueError(_("unknown command '{}'").format(command))
+        text = args.pop("text", None)
+        path = args.pop("path", None)
+        if text is None:
+            if path is None:
+                raise ValueError(_("the budget text or path is missing"))
+            text = self.manager.read_text_from_file(path)
+            if text is None:
+                raise ValueError(_("could not read '{}'").format(path))
+        for name in ("start", "end"):
+            if name in args:
+                args[name] = parse_date(args[name])
+        with self.lock:
+            if command == "png":
+                return self.manager.create_png_graph_from_text(text = text,
+                    **args)
+            return encode_timeseries(
+                self.manager.create_timeseries_from_text(text = text, **args))
+
+    def serve(self):
+        """ Serve until shutdown() is called and remove the socket afterwards
+        """
+        self.logger.info(_("Listening on '{}'").format(self.server_address))
+        try:
+            self.serve_forever()
+        finally:
+            self.server_close()
+            try:
+                os.unlink(self.server_address)
+            except OSError:
+                pass
+
+
+class DaemonClient(WithLogger):
+    """ A connection to a running ForecastDaemon. The connection is opened on
+    the first request and kept open.
+    """
+    def __init__(self, path, timeout = None):
+        """ class constructor
+        Args:
+            path (path): the socket path
+            timeout [Optional(float)]: the timeout in seconds for connecting
+                and every answer. Defaults to None which means no timeout.
+        """
+        self.path = path
+        self.timeout = timeout
+        self.connection = None
+        self.lock = threading.Lock()
+
+    ### properties ###
+    @property
+    def available(self):
+        """ Whether a daemon socket exists. The daemon might still be gone.
+        """
+        return os.path.exists(self.path)
+
+    ### methods ###
+    def connect(self):
+        """ Open the connection if it isn't open yet
+        Raises:
+            OSError: if the daemon is not reachable
+        """
+        if self.connection is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            try:
+                sock.connect(self.path)
+            except OSError:
+                sock.close()
+                raise
+            self.connection = (sock, sock.makefile("rb"))
+
+    def close(self):
+        """ Close the connection
+        """
+        if self.connection is not None:
+            sock, rfile = self.connection
+            rfile.close()
+            sock.close()
+            self.connection = None
+
+    def request(self, command, **args):
+        """ Send a request and wait for the answer. A connection the daemon
+        closed in the meantime is opened again once, a request that timed out
+        is not sent again.
+        Args:
+            command (str): the command, see ForecastDaemon.handle_request
+            args (keyword arguments): the JSON-serializable arguments
+        Returns:
+            result (JSON-serializable): the result of the command
+        Raises:
+            OSError: if the daemon is not reachable
+            DaemonError: if the daemon could not handle the request
+        """
+        message = json.dumps(dict(args, command = command)).encode("utf-8")
+        with self.lock:
+            for attempt in (1, 2):
+                reused = self.connection is not None
+                self.connect()
+                sock, rfile = self.connection
+                try:
+                    sock.sendall(message + b"\n")
+                    line = rfile.readline()
+                    if not line:
+                        raise ConnectionResetError(
+                            _("the daemon closed the connection"))
+                    break
+                except OSError as e:
+                    self.close()
+                    if not reused or attempt == 2 or \
+                        not isinstance(e, ConnectionError):
+                        raise
+        response = json.loads(line.decode("utf-8"))
+        if not response.get("ok"):
+            raise DaemonError(response.get("error"))
+        return response.get("result")
+
+    def forecast_arguments(self, start, end, **kwargs):
+        """ The arguments of a forecast request
+        Args:
+            start, end (datetime.datetime): the date range
+            kwargs (keyword arguments): further arguments
+        Returns:
+            args (dict): the arguments with the dates as YYYY-MM-DD
+        """
+        return dict(kwargs, start = start.strftime("%Y-%m-%d"),
+            end = end.strftime("%Y-%m-%d"))
+
+    def timeseries(self, start, end, **kwargs):
+        """ Let the daemon simulate a budget
+        Args:
+            start, end (datetime.datetime): the date range
+            kwargs (keyword arguments): the budget 'text' or 'path' and
+                further arguments for
+                SimbutoManager.create_timeseries_from_text
+        Returns:
+            timeseries (dict of numpy.ndarray or None): the timeseries, None
+                if the simulation failed
+        Raises:
+            OSError: if the daemon is not reachable
+            DaemonError: if the daemon could not handle the request
+        """
+        return decode_timeseries(self.request("timeseries",
+            **self.forecast_arguments(start, end, **kwargs)))
+
+    def png(self, filename, start, end, **kwargs):
+        """ Let the daemon plot a budget to a png file
+        Args:
+            filename (path): the png file
+            start, end (datetime.datetime): the date range
+            kwargs (keyword arguments): the budget 'text' or 'path' and
+                further arguments for SimbutoManager.create_png_graph_from_text
+        Returns:
+            success (bool): True if the png file was created
+        Raises:
+            OSError: if the daemon is not reachable
+            DaemonError: if the daemon could not handle the request
+        """
+        return bool(self.request("png", **self.forecast_arguments(start, end,
+            filename = os.path.abspath(filename), **kwargs)))
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# external modules
+import numpy as np
+
+
+def envelope_indices(lower, upper, buckets):
+    """ Decimate a band by keeping the minimum of its lower and the maximum of
+    its upper edge in every bucket. With one bucket per pixel column the drawn
+    band looks the same and its extremes stay exact.
+    Args:
+        lower, upper (numpy.ndarray): the edges of the band
+        buckets (int): the number of buckets, e.g. the plot width in pixels
+    Returns:
+        indices (numpy.ndarray of int): the sorted indices to keep, at most
+            2 * buckets + 2. The first and last index are always kept.
+    """
+    n = len(lower)
+    buckets = max(int(buckets), 1)
+    if n <= 2 * buckets + 2:
+        return np.arange(n)
+    size = -(-n // buckets) # ceil
+    def reshaped(values):
+        # pad with the last value to fill the last bucket, this adds no
+        # extremes
+        padded = np.pad(values, (0, buckets * size - n), mode = "edge")
+        return padded.reshape(buckets, size)
+    offsets = np.arange(buckets) * size
+    indices = np.concatenate([[0, n - 1],
+        offsets + np.argmin(reshaped(lower), axis = 1),
+        offsets + np.argmax(reshaped(upper), axis = 1)])
+    return np.unique(np.minimum(indices, n - 1))
+
+def minmax_indices(values, buckets):
+    """ Decimate a series by keeping the minimum and maximum of every bucket
+    Args:
+        values (numpy.ndarray): the series
+        buckets (int): the number of buckets, e.g. the plot width in pixels
+    Returns:
+        indices (numpy.ndarray of int): see envelope_indices
+    """
+    return envelope_indices(values, values, buckets)
+
+def decimate_timeseries(timeseries, buckets):
+    """ Decimate all series of a timeseries with common days. The envelope of
+    all series, e.g. the worst and best case or the ensemble quantiles, keeps
+    its minimum and maximum in every bucket and so do the 'amount' and
+    'ensmean' lines. The other series are taken at the same days, so there
+    are at most about four days per bucket.
+    Args:
+        timeseries (dict of numpy.ndarray): the timeseries with a 'day' column
+        buckets (int): the number of buckets, e.g. the plot width in pixels
+    Returns:
+        timeseries (dict of numpy.ndarray): the decimated timeseries
+    """
+    series = [values for name, values in timeseries.items() if name != "day"]
+    if not series:
+        return timeseries
+    stacked = np.vstack(series)
+    indices = [envelope_indices(stacked.min(axis = 0),
+        stacked.max(axis = 0), buckets)]
+    for name in ("amount", "ensmean"): # the lines keep their own extremes
+        if name in timeseries:
+            indices.append(minmax_indices(timeseries[name], buckets))
+    indices = np.unique(np.concatenate(indices))
+    if len(indices) == len(timeseries["day"]):
+        return timeseries
+    return {name: values[indices] for name, values in timeseries.items()}
@@ -0,0 +1,1114 @@
+#!/usr/bin/env python3
+# system modules
+import csv
+import datetime
+import re
+import hashlib
+import statistics
+import collections
+import concurrent.futures
+
+# external modules
+import numpy as np
+
+# internal modules
+from . import utils
+from . import recurrence
+from .timing import stage
+
+# the horizons in years up to which auto_resolution picks days and weeks
+AUTO_RESOLUTION_DAYS = 5
+AUTO_RESOLUTION_WEEKS = 20
+
+
+###############
+### Parsing ###
+###############
+def parse_amount(string):
+    """ Convert a simbuto amount string like R's read.csv2 would
+    Args:
+        string (str): the amount string, with decimal comma or point
+    Returns:
+        amount (float): the amount or NaN if it could not be converted
+    """
+    string = string.strip()
+    try:
+        return float(string.replace(",","."))
+    except ValueError:
+        return np.nan
+
+def parse_date(string):
+    """ Convert a simbuto date string in ISO format to a numpy.datetime64
+    Args:
+        string (str): the date string in %Y-%m-%d format
+    Returns:
+        date (numpy.datetime64): the date or NaT if it could not be converted
+    """
+    try:
+        date = datetime.datetime.strptime(string.strip(),"%Y-%m-%d").date()
+        return np.datetime64(date,"D")
+    except ValueError:
+        return np.datetime64("NaT","D")
+
+def parse_dates(string):
+    """ Convert a list of dates in ISO format separated by commas or spaces
+    Args:
+        string (str): the date strings
+    Returns:
+        dates (numpy.ndarray of numpy.datetime64): the dates, NaT for those
+            that could not be converted
+    """
+    return np.array([parse_date(s) for s in re.split(r"[\s,]+", string)
+        if s], dtype="datetime64[D]")
+
+def strip_comment(line):
+    """ Remove everything after a '#' that is not inside quotes
+    Args:
+        line (str): the line
+    Returns:
+        line (str): the line without comment
+    """
+    quoted = False
+    for i, char in enumerate(line):
+        if char == '"':
+            quoted = not quoted
+        elif char == "#" and not quoted:
+            return line[:i]
+    return line
+
+def read_budget_from_text(text, opening_stock = 0, today = None):
+    """ Read a simbuto budget from csv-like text like the R function
+    read_budget_from_text does.
+    Args:
+        text (str): the csv-like simbuto budget
+        opening_stock [Optional(float)]: The opening stock. Defaults to 0.
+        today [Optional(datetime.date)]: the day of the opening stock. Defaults
+            to the current day.
+    Returns:
+        budget (list of dict): the budget facts, the opening stock first
+    """
+    # strip comments and skip blank lines
+    lines = [strip_comment(l) for l in text.splitlines()]
+    lines = [l for l in lines if l.strip()]
+    budget = [opening_stock_fact(opening_stock, today)]
+    if not lines:
+        return budget
+    reader = csv.reader(lines, delimiter=";", quotechar='"')
+    header = [h.strip() for h in next(reader)]
+    for row in reader:
+        budget.append(fact_from_fields(dict(zip(header, row))))
+    return budget
+
+def opening_stock_fact(opening_stock = 0, today = None):
+    """ The budget fact of the opening stock
+    Args:
+        opening_stock [Optional(float)]: The opening stock. Defaults to 0.
+        today [Optional(datetime.date)]: the day of the opening stock. Defaults
+            to the current day.
+    Returns:
+        fact (dict): the budget fact
+    """
+    if today is None: today = datetime.date.today()
+    return {
+        "title": "opening stock", "frequency": "once",
+        "amount": float(opening_stock), "start": np.datetime64(today,"D"),
+        "end": np.datetime64("NaT","D"),
+        "tolerance_day": np.nan, "tolerance_amount": np.nan,
+        "skip": np.array([], dtype="datetime64[D]"),
+        }
+
+def fact_from_fields(fields):
+    """ Convert the fields of a budget line into a budget fact
+    Args:
+        fields (dict): the field strings by column name
+    Returns:
+        fact (dict): the budget fact, unconvertible values are NaN or NaT
+    """
+    return {
+        "title": fields.get("title",""),
+        "frequency": recurrence.normalize_frequency(
+            fields.get("frequency","")),
+        "amount": parse_amount(fields.get("amount","")),
+        "start": parse_date(fields.get("start","")),
+        "end": parse_date(fields.get("end","")),
+        "tolerance_day": parse_amount(fields.get("tolerance_day","")),
+        "tolerance_amount": parse_amount(fields.get("tolerance_amount","")),
+        "skip": parse_dates(fields.get("skip","")),
+        }
+
+
+##################
+### Simulation ###
+##################
+def fact_indices(fact, start, end):
+    """ The day indices of a fact's occurences within the given date range
+    Args:
+        fact (dict): the budget fact
+        start, end (numpy.datetime64): the first and last day
+    Returns:
+        indices (numpy.ndarray of int): the indices of the occurence days
+            relative to start
+    """
+    fact_start = fact["start"]
+    if np.isnat(fact_start): fact_start = start + 1
+    fact_end = fact["end"]
+    if np.isnat(fact_end): fact_end = end
+    return recurrence.occurence_offsets(fact["frequency"], fact_start,
+        fact_end, start, end, skip = fact.get("skip"))
+
+def fact_parameters(fact):
+    """ The amount and tolerances of a fact with missing values replaced
+    Args:
+        fact (dict): the budget fact
+    Returns:
+        amount, tolerance_amount, tolerance_day (float, float, int): the
+            parameters
+    """
+    amount = fact["amount"] if np.isfinite(fact["amount"]) else 0
+    tolerance_amount = abs(fact["tolerance_amount"]) \
+        if np.isfinite(fact["tolerance_amount"]) else 0
+    tolerance_day = int(abs(fact["tolerance_day"])) \
+        if np.isfinite(fact["tolerance_day"]) else 0
+    return amount, tolerance_amount, tolerance_day
+
+def budget_facts(budget, start, end):
+    """ The occurences and parameters of all facts that occur in the given
+    date range
+    Args:
+        budget (list of dict): the budget facts as from read_budget_from_text
+        start, end (numpy.datetime64): the first and last day
+    Returns:
+        facts (list of tuple): the (indices, amount, tolerance_amount,
+            tolerance_day) of every occuring fact
+    """
+    facts = []
+    for fact in budget:
+        indices = fact_indices(fact, start, end)
+        if len(indices):
+            facts.append((indices,) + fact_parameters(fact))
+    return facts
+
+def facts_events(facts):
+    """ Concatenate the occurences of facts into a flat list of events
+    Args:
+        facts (list of tuple): the facts as from budget_facts
+    Returns:
+        events (dict of numpy.ndarray): the 'day' indices relative to start
+            and the 'amount', 'tolerance_amount' and 'tolerance_day' of every
+            occurence
+    """
+    if not facts:
+        return {"day": np.array([], dtype=int), "amount": np.array([]),
+            "tolerance_amount": np.array([]),
+            "tolerance_day": np.array([], dtype=int)}
+    indices, amount, tolerance_amount, tolerance_day = zip(*facts)
+    counts = [len(i) for i in indices]
+    return {
+        "day": np.concatenate(indices),
+        "amount": np.repeat(np.array(amount, dtype=float), counts),
+        "tolerance_amount": np.repeat(
+            np.array(tolerance_amount, dtype=float), counts),
+        "tolerance_day": np.repeat(np.array(tolerance_day, dtype=int), counts),
+        }
+
+def budget_events(budget, start, end):
+    """ Expand the facts of a budget into a flat list of occurences
+    Args:
+        budget (list of dict): the budget facts as from read_budget_from_text
+        start, end (numpy.datetime64): the first and last day
+    Returns:
+        events (dict of numpy.ndarray): the 'day' indices relative to start
+            and the 'amount', 'tolerance_amount' and 'tolerance_day' of every
+            occurence
+    """
+    return facts_events(budget_facts(budget, start, end))
+
+def scatter(indices, amounts, N):
+    """ Sum amounts into a series of length N, indices outside are put into
+    the first or last element
+    Args:
+        indices (numpy.ndarray of int): the indices
+        amounts (numpy.ndarray of float or float): the amounts
+        N (int): the output length
+    Returns:
+        series (numpy.ndarray of float): the summed amounts
+    """
+    amounts = np.broadcast_to(amounts, np.shape(indices)).ravel()
+    return np.bincount(np.clip(indices, 0, N - 1).ravel(),
+        weights = amounts, minlength = N)
+
+def draw_ensemble(indices, amount, tolerance_amount, tolerance_day, members,
+    N, rng, buckets = None):
+    """ Draw random amounts and days of a fact's occurences for all ensemble
+    members at once
+    Args:
+        indices (numpy.ndarray of int): the indices of the occurence days
+        amount, tolerance_amount, tolerance_day (float, float, int): the
+            fact parameters
+        members (int): the number of members
+        N (int): the number of days
+        rng (numpy.random.Generator): the random number generator
+        buckets [Optional(numpy.ndarray of int)]: the period of every day
+            from resolution_buckets. Defaults to None which means daily.
+    Returns:
+        cells, amounts (numpy.ndarray): the indices into the flattened members
+            x days (or periods) matrix and the amounts to add there
+    """
+    shape = (members, len(indices))
+    # draw all members' amount and day jitters as one matrix
+    amounts = np.rint(rng.uniform(amount - tolerance_amount,
+        amount + tolerance_amount, shape))
+    jitter = np.rint(rng.uniform(-tolerance_day, tolerance_day, shape))
+    days = np.clip(indices + jitter.astype(int), 0, N - 1)
+    width = N
+    if buckets is not None: # the jittered days fall into their periods
+        days, width = buckets[days], buckets[-1] + 1
+    cells = days + np.arange(members)[:,np.newaxis] * width
+    return cells.ravel(), amounts.ravel()
+
+def scatter_ensemble(ensemble, indices, amount, tolerance_amount,
+    tolerance_day, rng, buckets = None):
+    """ Draw random amounts and days of a fact's occurences for all ensemble
+    members at once and add them to the ensemble
+    Args:
+        ensemble (numpy.ndarray): the members x days (or periods) ensemble
+            matrix, modified in-place
+        indices (numpy.ndarray of int): the indices of the occurence days
+        amount, tolerance_amount, tolerance_day (float, float, int): the
+            fact parameters
+        rng (numpy.random.Generator): the random number generator
+        buckets [Optional(numpy.ndarray of int)]: the period of every day
+            from resolution_buckets. Defaults to None which means daily.
+    """
+    members, N = ensemble.shape
+    if buckets is not None:
+        N = len(buckets)
+    cells, amounts = draw_ensemble(indices, amount, tolerance_amount,
+        tolerance_day, members, N, rng, buckets = buckets)
+    # add all of them into the flattened matrix in one step
+    np.add.at(ensemble.reshape(-1), cells, amounts)
+
+def ensemble_members(facts, members, N, rng, buckets = None):
+    """ Simulate cumulated ensemble members
+    Args:
+        facts (list of tuple): the occurence indices, amount, tolerance_amount
+            and tolerance_day of each fact
+        members (int): the number of members
+        N (int): the number of days
+        rng (numpy.random.Generator): the random number generator
+        buckets [Optional(numpy.ndarray of int)]: the period of every day
+            from resolution_buckets. Defaults to None which means daily.
+    Returns:
+        ensemble (numpy.ndarray): the cumulated members x days (or periods)
+            matrix
+    """
+    ensemble = np.zeros((members, N if buckets is None else buckets[-1] + 1))
+    for fact in facts:
+        scatter_ensemble(ensemble, *fact, rng = rng, buckets = buckets)
+    return np.cumsum(ensemble, axis = 1, out = ensemble)
+
+def ensemble_bounds(facts, N):
+    """ Lower and upper bounds of every possible cumulated ensemble member
+    Args:
+        facts (list of tuple): the occurence indices, amount, tolerance_amount
+            and tolerance_day of each fact
+        N (int): the number of days
+    Returns:
+        lower, upper (numpy.ndarray): the bounds for each day
+    """
+    lower, upper = np.zeros(N), np.zeros(N)
+    for indices, amount, tolerance_amount, tolerance_day in facts:
+        # rounding may exceed the amount tolerance by half a unit
+        low = amount - tolerance_amount - 0.5
+        high = amount + tolerance_amount + 0.5
+        early, late = indices - tolerance_day, indices + tolerance_day
+        # negative amounts pull down as early, positive ones as late as
+        # possible and vice versa
+        lower += scatter(early, min(low, 0), N) + scatter(late, max(low, 0), N)
+        upper += scatter(early, max(high, 0), N) \
+            + scatter(late, min(high, 0), N)
+    return np.cumsum(lower), np.cumsum(upper)
+
+class HistogramQuantiles(object):
+    """ Streaming per-day quantile estimates from fixed histogram bins. The
+    memory usage only depends on the number of days and bins, not on the number
+    of members added.
+    """
+    def __init__(self, lower, upper, bins = 256):
+        """ class constructor
+        Args:
+            lower, upper (numpy.ndarray): the per-day range of the bins. Values
+                outside are counted in the first or last bin.
+            bins [Optional(int)]: the number of bins per day. Defaults to 256.
+        """
+        self.lower = np.asarray(lower, dtype = float)
+        self.width = (np.asarray(upper, dtype = float) - self.lower) / bins
+        self.bins = bins
+        self.counts = np.zeros((len(self.lower), bins), dtype = np.int64)
+        self.size = 0
+
+    def add(self, members):
+        """ Count cumulated members into the histograms
+        Args:
+            members (numpy.ndarray): the members x days matrix
+        """
+        N = len(self.lower)
+        width = np.where(self.width > 0, self.width, 1)
+        bins = np.clip(((members - self.lower) / width).astype(np.int64),
+            0, self.bins - 1)
+        flat = bins + np.arange(N) * self.bins
+        self.counts += np.bincount(flat.ravel(),
+            minlength = N * self.bins).reshape(N, self.bins)
+        self.size += members.shape[0]
+
+    def merge(self, other):
+        """ Add the counts of another histogram with the same bins
+        Args:
+            other (HistogramQuantiles): the other histogram
+        """
+        self.counts += other.counts
+        self.size += other.size
+
+    def quantile(self, q):
+        """ Estimate a quantile for each day, linearly interpolated within the
+        bin. The error is at most one bin width.
+        Args:
+            q (float): the probability between 0 and 1
+        Returns:
+            quantile (numpy.ndarray): the quantile for each day
+        """
+        cumulated = np.cumsum(self.counts, axis = 1)
+        rank = q * self.size
+        # the first bin reaching the rank
+        binnr = np.argmax(cumulated >= rank, axis = 1)[:,np.newaxis]
+        count = np.take_along_axis(self.counts, binnr, axis = 1)[:,0]
+        before = np.take_along_axis(cumulated, binnr, axis = 1)[:,0] - count
+        fraction = np.clip((rank - before) / np.maximum(count, 1), 0, 1)
+        return self.lower + self.width * (binnr[:,0] + fraction)
+
+def ensemble_batch(facts, members, N, seed_sequence, chunk_size = None,
+    bounds = None, bins = 256, buckets = None):
+    """ Simulate a batch of ensemble members with its own random stream
+    Args:
+        facts (list of tuple): the occurence indices, amount, tolerance_amount
+            and tolerance_day of each fact
+        members (int): the number of members
+        N (int): the number of days
+        seed_sequence (numpy.random.SeedSequence): the seed of the random
+            stream
+        chunk_size [Optional(int)]: stream the members in chunks of this size
+            through histograms. Defaults to None which means no streaming.
+        bounds [Optional(tuple)]: the lower and upper histogram bounds, needed
+            for streaming
+        bins [Optional(int)]: the number of histogram bins. Defaults to 256.
+        buckets [Optional(numpy.ndarray of int)]: the period of every day
+            from resolution_buckets. Defaults to None which means daily.
+    Returns:
+        ensemble (numpy.ndarray or HistogramQuantiles): the cumulated members
+            x days (or periods) matrix or the histograms if streaming
+    """
+    rng = np.random.default_rng(seed_sequence)
+    if not chunk_size:
+        return ensemble_members(facts, members, N, rng, buckets = buckets)
+    histogram = HistogramQuantiles(*bounds, bins = bins)
+    for chunk in range(0, members, chunk_size):
+        histogram.add(ensemble_members(facts,
+            min(chunk_size, members - chunk), N, rng, buckets = buckets))
+    return histogram
+
+def simulate_ensemble(facts, ensemble_size, N, seed = None, workers = 1,
+    executor = "thread", chunk_size = None, bins = 256, buckets = None):
+    """ Simulate the ensemble and calculate its 5% and 95% quantiles. The
+    members are spread evenly over the workers, each with an independent random
+    stream spawned from the seed. The same seed and number of workers thus
+    always give the same quantiles.
+    Args:
+        facts (list of tuple): the occurence indices, amount, tolerance_amount
+            and tolerance_day of each fact
+        ensemble_size (int): the number of members
+        N (int): the number of days
+        seed [Optional(int)]: the random seed. Defaults to None which means a
+            random seed.
+        workers [Optional(int)]: the number of workers. Defaults to 1.
+        executor [Optional(str)]: the worker pool, either 'thread' or
+            'process'. Defaults to 'thread'.
+        chunk_size [Optional(int)]: stream the members in chunks of this size
+            through histograms. Defaults to None which means no streaming.
+        bins [Optional(int)]: the number of histogram bins. Defaults to 256.
+        buckets [Optional(numpy.ndarray of int)]: the period of every day
+            from resolution_buckets. Defaults to None which means daily.
+    Returns:
+        quant05, quant95 (numpy.ndarray): the quantiles for each day (or
+            period)
+    """
+    workers = max(1, min(workers, ensemble_size))
+    seed_sequences = np.random.SeedSequence(seed).spawn(workers)
+    # split the members evenly
+    sizes = [len(a) for a in np.array_split(np.arange(ensemble_size), workers)]
+    bounds = None
+    if chunk_size:
+        bounds = ensemble_bounds(facts, N)
+        if buckets is not None: # the bounds at the end of every period
+            bounds = tuple(b[bucket_ends(buckets)] for b in bounds)
+    arguments = [(facts, size, N, seed_sequence, chunk_size, bounds, bins,
+        buckets) for size, seed_sequence in zip(sizes, seed_sequences)]
+    if workers == 1:
+        batches = [ensemble_batch(*arguments[0])]
+    else:
+        pool = concurrent.futures.ProcessPoolExecutor \
+            if executor == "process" else concurrent.futures.ThreadPoolExecutor
+        with pool(max_workers = workers) as p:
+            batches = list(p.map(ensemble_batch, *zip(*arguments)))
+    # merge the batches
+    if chunk_size:
+        histogram = batches[0]
+        for batch in batches[1:]:
+            histogram.merge(batch)
+        return histogram.quantile(0.05), histogram.quantile(0.95)
+    ensemble = np.concatenate(batches)
+    return tuple(np.quantile(ensemble, [0.05, 0.95], axis = 0))
+
+def day_jitter_pmf(tolerance_day):
+    """ The distribution of the rounded uniform day jitter of the ensemble
+    Args:
+        tolerance_day (int): the day tolerance
+    Returns:
+        offsets, probabilities (numpy.ndarray): the possible day offsets and
+            their probabilities
+    """
+    offsets = np.arange(-tolerance_day, tolerance_day + 1)
+    if not tolerance_day:
+        return offsets, np.ones(1)
+    # rounding gives the outermost offsets only half the interval
+    probabilities = np.full(len(offsets), 1 / (2 * tolerance_day))
+    probabilities[[0, -1]] /= 2
+    return offsets, probabilities
+
+def rounded_uniform_cumulants(amount, tolerance_amount):
+    """ The first four cumulants of the amounts the ensemble draws, which are
+    uniform between amount - tolerance_amount and amount + tolerance_amount
+    and then rounded to integers
+    Args:
+        amount, tolerance_amount (numpy.ndarray): the parameters
+    Returns:
+        mean, variance, third, fourth (numpy.ndarray): the cumulants
+    """
+    amount = np.asarray(amount, dtype=float)
+    tolerance_amount = np.asarray(tolerance_amount, dtype=float)
+    # rounding commutes with integer shifts, so the central moments are
+    # calculated around the rounded amount where the powers stay small
+    sure = np.rint(amount)
+    shifted = amount - sure
+    def integrals(x): # integrals of rint(u)**k from 0 to x for k = 1...4
+        sign, x = np.sign(x), np.abs(x)
+        m = np.floor(x + 0.5)
+        rest = x - m + 0.5
+        sums = ((m - 1) * m / 2, (m - 1) * m * (2 * m - 1) / 6,
+            ((m - 1) * m / 2) ** 2, (m - 1) * m * (2 * m - 1)
+            * (3 * m ** 2 - 3 * m - 1) / 30) # of j**k for j < m
+        return [(sign if k % 2 else 1) * (total + m ** (k + 1) * rest)
+            for k, total in enumerate(sums)]
+    width = np.where(tolerance_amount > 0, 2 * tolerance_amount, 1)
+    m1, m2, m3, m4 = [np.where(tolerance_amount > 0, (upper - lower) / width,
+        0) for lower, upper in zip(integrals(shifted - tolerance_amount),
+        integrals(shifted + tolerance_amount))]
+    variance = np.maximum(m2 - m1 ** 2, 0)
+    third = m3 - 3 * m1 * m2 + 2 * m1 ** 3
+    fourth = m4 - 4 * m1 * m3 + 6 * m1 ** 2 * m2 - 3 * m1 ** 4 \
+        - 3 * variance ** 2
+    return sure + m1, variance, third, fourth
+
+def occurred_cumulants(probability, mean, variance, third, fourth):
+    """ The first four cumulants of an amount that occurred with a
+    probability and is zero otherwise
+    Args:
+        probability (numpy.ndarray): the probability of the occurence
+        mean, variance, third, fourth (numpy.ndarray): the cumulants of the
+            amount
+    Returns:
+        cumulants (tuple of numpy.ndarray): the four cumulants
+    """
+    p = probability
+    # the raw moments are those of the amount times the probability
+    r1 = p * mean
+    r2 = p * (variance + mean ** 2)
+    r3 = p * (third + 3 * mean * variance + mean ** 3)
+    r4 = p * (fourth + 3 * variance ** 2 + 4 * mean * third
+        + 6 * mean ** 2 * variance + mean ** 4)
+    return (r1, r2 - r1 ** 2, r3 - 3 * r2 * r1 + 2 * r1 ** 3,
+        r4 - 4 * r3 * r1 - 3 * r2 ** 2 + 12 * r2 * r1 ** 2 - 6 * r1 ** 4)
+
+def analytic_cumulants(facts, N):
+    """ The exact first four cumulants of the cumulated ensemble for each
+    day. The amount and the day of every occurence are independent rounded
+    uniforms like in draw_ensemble, so the cumulants of the occurences add
+    up. The cost is that of a single deterministic run times the number of
+    day offsets.
+    Args:
+        facts (list of tuple): the occurence indices, amount, tolerance_amount
+            and tolerance_day of each fact
+        N (int): the number of days
+    Returns:
+        mean, variance, third, fourth (numpy.ndarray): the cumulants for each
+            day
+    """
+    done = [np.zeros(N) for k in range(4)]
+    local = [np.zeros(N) for k in range(4)]
+    events = facts_events(facts)
+    for tolerance_day in np.unique(events["tolerance_day"]):
+        select = events["tolerance_day"] == tolerance_day
+        day = events["day"][select]
+        amount = rounded_uniform_cumulants(events["amount"][select],
+            events["tolerance_amount"][select])
+        offsets, probabilities = day_jitter_pmf(tolerance_day)
+        days = day[:,np.newaxis] + offsets
+        # from the last day of the jitter window on, the occurence surely
+        # happened, cumulated below
+        for total, cumulant in zip(done, amount):
+            total += scatter(days[:,-1], cumulant, N)
+        # within the window it happened with the probability so far, days
+        # outside the series are clipped to its first or last day
+        cdf = np.cumsum(probabilities)[:-1]
+        window = days[:,:-1]
+        inside = (window >= 0) & (window < N - 1)
+        partial = occurred_cumulants(cdf, *[cumulant[:,np.newaxis]
+            for cumulant in amount])
+        for total, cumulant in zip(local, partial):
+            total += np.bincount(window[inside], weights =
+                np.broadcast_to(cumulant, window.shape)[inside],
+                minlength = N)
+    return tuple(np.cumsum(total) + part for total, part in zip(done, local))
+
+def analytic_quantiles(facts, N, quantiles = (0.05, 0.95), bounds = None):
+    """ Quantiles of the ensemble from the analytic cumulants with the
+    Cornish-Fisher expansion. The sum of many independent occurences
+    approaches a normal distribution, the expansion corrects for its skewness
+    and kurtosis.
+    Args:
+        facts (list of tuple): the occurence indices, amount, tolerance_amount
+            and tolerance_day of each fact
+        N (int): the number of days
+        quantiles [Optional(sequence of float)]: the quantiles. Defaults to
+            5% and 95%.
+        bounds [Optional(tuple of numpy.ndarray)]: the lowest and highest
+            possible values, e.g. the worst and best case, to clamp the
+            quantiles to. Defaults to None which means no clamping.
+    Returns:
+        quantiles (tuple of numpy.ndarray): the quantiles for each day
+    """
+    return cornish_fisher_quantiles(*analytic_cumulants(facts, N),
+        quantiles = quantiles, bounds = bounds)
+
+def cornish_fisher_quantiles(mean, variance, third = 0, fourth = 0,
+    quantiles = (0.05, 0.95), bounds = None):
+    """ Quantiles of distributions from their first four cumulants with the
+    Cornish-Fisher expansion
+    Args:
+        mean, variance (numpy.ndarray): the cumulants for each day
+        third, fourth [Optional(numpy.ndarray)]: the third and fourth
+            cumulants for each day. Default to 0 which means normal
+            distributions.
+        quantiles [Optional(sequence of float)]: the quantiles. Defaults to
+            5% and 95%.
+        bounds [Optional(tuple of numpy.ndarray)]: the lowest and highest
+            possible values to clamp the quantiles to. Defaults to None which
+            means no clamping.
+    Returns:
+        quantiles (tuple of numpy.ndarray): the quantiles for each day
+    """
+    deviation = np.sqrt(np.maximum(variance, 0))
+    uncertain = deviation > 0
+    scale = np.where(uncertain, deviation, 1)
+    skewness = np.where(uncertain, third / scale ** 3, 0)
+    kurtosis = np.where(uncertain, fourth / scale ** 4, 0)
+    result = []
+    for q in quantiles:
+        z = statistics.NormalDist().inv_cdf(q)
+        values = mean + deviation * (z + (z ** 2 - 1) * skewness / 6
+            + (z ** 3 - 3 * z) * kurtosis / 24
+            - (2 * z ** 3 - 5 * z) * skewness ** 2 / 36)
+        if bounds is not None:
+            values = np.clip(values, np.minimum(*bounds), np.maximum(*bounds))
+        result.append(values)
+    return tuple(result)
+
+def resolution_buckets(days, resolution = "day"):
+    """ Group days into calendar periods
+    Args:
+        days (numpy.ndarray of numpy.datetime64): the consecutive days
+        resolution [Optional(str)]: 'day', 'week' (Monday to Sunday) or
+            'month'. Defaults to 'day'.
+    Returns:
+        buckets (numpy.ndarray of int or None): the index of the period of
+            every day, None for daily resolution
+    Raises:
+        ValueError: if the resolution is unknown
+    """
+    if resolution == "day":
+        return None
+    if resolution == "week": # 1970-01-05 was a Monday
+        periods = (days - np.datetime64("1970-01-05","D")).astype(int) // 7
+    elif resolution == "month":
+        periods = days.astype("datetime64[M]")
+    else:
+        raise ValueError(_("invalid resolution '{}'").format(resolution))
+    return np.concatenate([[0], np.cumsum(periods[1:] != periods[:-1])])
+
+def bucket_ends(buckets):
+    """ The last day of every period
+    Args:
+        buckets (numpy.ndarray of int): the period of every day as from
+            resolution_buckets
+    Returns:
+        ends (numpy.ndarray of int): the index of the last day of every period
+    """
+    return np.append(np.flatnonzero(np.diff(buckets)), len(buckets) - 1)
+
+def auto_resolution(start, end):
+    """ A resolution that keeps the number of periods moderate
+    Args:
+        start, end (datetime.date): the first and last day
+    Returns:
+        resolution (str): 'day' up to AUTO_RESOLUTION_DAYS years, 'week' up
+            to AUTO_RESOLUTION_WEEKS years and 'month' beyond
+    """
+    years = (np.datetime64(end,"D") - np.datetime64(start,"D")).astype(int) \
+        / 365.25
+    if years <= AUTO_RESOLUTION_DAYS:
+        return "day"
+    if years <= AUTO_RESOLUTION_WEEKS:
+        return "week"
+    return "month"
+
+def facts_series(facts, N):
+    """ The cumulated undisturbed, worst case and best case series of facts
+    Args:
+        facts (list of tuple): the facts as from budget_facts
+        N (int): the number of days
+    Returns:
+        series (dict of numpy.ndarray): the 'amount', 'worstcase' and
+            'bestcase' series
+    """
+    events = facts_events(facts)
+    day, amount = events["day"], events["amount"]
+    shift = np.sign(amount).astype(int) * events["tolerance_day"]
+    return {
+        # undisturbed - original
+        "amount": np.cumsum(scatter(day, amount, N)),
+        # worst case: costs highest and earliest, incomes lowest and latest
+        "worstcase": np.cumsum(scatter(day + shift,
+            amount - events["tolerance_amount"], N)),
+        # best case: costs lowest and latest, incomes highest and earliest
+        "bestcase": np.cumsum(scatter(day - shift,
+            amount + events["tolerance_amount"], N)),
+        }
+
+def timeseries_from_budget(budget, start, end, ensemble_size = None,
+    seed = None, ensemble_chunk_size = None, ensemble_bins = 256,
+    workers = 1, executor = "thread", ensemble_mode = "montecarlo",
+    resolution = "day", timer = None):
+    """ Simulate a budget like the R function timeseries_from_budget does
+    Args:
+        budget (list of dict): the budget facts as from read_budget_from_text
+        start, end (datetime.date): the first and last day
+        ensemble_size [Optional(int)]: the ensemble size. Defaults to None
+            which means no ensemble.
+        seed [Optional(int)]: the random seed for the ensemble. Defaults to
+            None which means a random seed.
+        ensemble_chunk_size [Optional(int)]: If set, stream the ensemble in
+            chunks of this many members and estimate the quantiles from
+            per-day histograms with constant memory usage. Defaults to None
+            which means to keep the whole ensemble in memory and calculate
+            exact quantiles.
+        ensemble_bins [Optional(int)]: the number of histogram bins per day
+            when streaming the ensemble. Defaults to 256.
+        workers [Optional(int)]: the number of workers to spread the ensemble
+            members over. Defaults to 1.
+        executor [Optional(str)]: the worker pool, either 'thread' or
+            'process'. Defaults to 'thread'.
+        ensemble_mode [Optional(str)]: 'montecarlo' to simulate the ensemble
+            members or 'analytic' to calculate the quantiles from the exact
+            mean and variance without sampling. Defaults to 'montecarlo'.
+        resolution [Optional(str)]: 'day', 'week' or 'month'. With a coarser
+            resolution than 'day', the series hold the values at the last day
+            of every calendar period and the ensemble members are only
+            simulated per period. Defaults to 'day'.
+        timer [Optional(timing.StageTimer)]: timer to record the stages in.
+            Defaults to None.
+    Returns:
+        timeseries (dict of numpy.ndarray): the columns 'day', 'amount',
+            'worstcase', 'bestcase' and with an ensemble 'ensquant05' and
+            'ensquant95'
+    Raises:
+        ValueError: if the budget, the date range or the resolution is invalid
+    """
+    start = np.datetime64(start,"D")
+    end = np.datetime64(end,"D")
+    if start > end:
+        raise ValueError(_("start date {} is after end date {}").format(
+            start, end))
+    days = np.arange(start, end + 1, dtype="datetime64[D]")
+    N = len(days)
+    buckets = resolution_buckets(days, resolution)
+
+    with stage(timer, "occurrences"):
+        facts = budget_facts(budget, start, end)
+    # all occurences as one sparse list of events, the cost only depends on
+    # the number of events and not on facts times days
+    with stage(timer, "series"):
+        timeseries = {"day": days}
+        timeseries.update(facts_series(facts, N))
+    use_ensemble = ensemble_size is not None and ensemble_size > 0
+    if use_ensemble and ensemble_mode == "analytic":
+        with stage(timer, "quantiles"):
+            timeseries["ensquant05"], timeseries["ensquant95"] = \
+                analytic_quantiles(facts, N, bounds = (
+                    timeseries["worstcase"], timeseries["bestcase"]))
+    if buckets is not None: # the values at the end of every period
+        ends = bucket_ends(buckets)
+        timeseries = {name: values[ends]
+            for name, values in timeseries.items()}
+    if use_ensemble and ensemble_mode != "analytic":
+        with stage(timer, "ensemble"): # including the quantiles
+            timeseries["ensquant05"], timeseries["ensquant95"] = \
+                simulate_ensemble(facts, ensemble_size, N, seed = seed,
+                    workers = workers, executor = executor,
+                    chunk_size = ensemble_chunk_size, bins = ensemble_bins,
+                    buckets = buckets)
+    return timeseries
+
+
+#################
+### Scenarios ###
+#################
+def truncate_facts(facts, N):
+    """ Drop the occurences of facts after the first N days
+    Args:
+        facts (list of tuple): the facts as from budget_facts
+        N (int): the number of days
+    Returns:
+        facts (list of tuple): the facts that still occur
+    """
+    truncated = []
+    for indices, *parameters in facts:
+        indices = indices[indices < N]
+        if len(indices):
+            truncated.append((indices, *parameters))
+    return truncated
+
+def scale_tolerances(facts, scale):
+    """ Scale the amount and day tolerances of facts
+    Args:
+        facts (list of tuple): the facts as from budget_facts
+        scale (float): the factor, the day tolerance is rounded
+    Returns:
+        facts (list of tuple): the scaled facts
+    """
+    if scale == 1:
+        return facts
+    return [(indices, amount, tolerance_amount * scale,
+        int(round(tolerance_day * scale)))
+        for indices, amount, tolerance_amount, tolerance_day in facts]
+
+def sweep_timeseries(budget, start, end, scenarios, today = None,
+    ensemble = False, timer = None):
+    """ Simulate many variants of a budget at once. The occurences of the
+    budget are expanded only once for the longest horizon. The series of the
+    budget are calculated once per distinct horizon and tolerance scale and
+    the opening stock and extra facts of every scenario are added on top.
+    Args:
+        budget (list of dict): the budget facts without opening stock
+        start, end (datetime.date): the first and the default last day
+        scenarios (list of dict): the variants with the optional keys
+            'opening_stock' (float, defaults to 0), 'end' (the last day,
+            defaults to end), 'tolerance_scale' (factor for all tolerances,
+            defaults to 1) and 'facts' (list of additional budget facts)
+        today [Optional(datetime.date)]: the day of the opening stock.
+            Defaults to the current day.
+        ensemble [Optional(bool)]: add the 'ensquant05' and 'ensquant95'
+            quantiles like the 'analytic' ensemble mode of
+            timeseries_from_budget. Monte Carlo ensembles can't be shared
+            between variants. Defaults to False.
+        timer [Optional(timing.StageTimer)]: timer to record the stages in.
+            Defaults to None.
+    Returns:
+        timeseries (list of dict of numpy.ndarray): the timeseries of every
+            scenario like timeseries_from_budget returns it
+    Raises:
+        ValueError: if the budget, a date range or a scale is invalid
+    """
+    start = np.datetime64(start,"D")
+    ends = [np.datetime64(s.get("end", end),"D") for s in scenarios]
+    for scenario, last in zip(scenarios, ends):
+        if start > last:
+            raise ValueError(_("start date {} is after end date {}").format(
+                start, last))
+        if scenario.get("tolerance_scale", 1) < 0:
+            raise ValueError(_("invalid tolerance scale {}").format(
+                scenario["tolerance_scale"]))
+    if not scenarios:
+        return []
+    with stage(timer, "occurrences"):
+        facts = budget_facts(budget, start, max(ends))
+    shared = {} # the series and cumulants per horizon and scale
+    results = []
+    with stage(timer, "scenarios"):
+        for scenario, last in zip(scenarios, ends):
+            N = int((last - start).astype(int)) + 1
+            scale = scenario.get("tolerance_scale", 1)
+            if (N, scale) not in shared:
+                scaled = scale_tolerances(truncate_facts(facts, N), scale)
+                shared[(N, scale)] = (facts_series(scaled, N),
+                    analytic_cumulants(scaled, N) if ensemble else None)
+            series, cumulants = shared[(N, scale)]
+            own = scale_tolerances(budget_facts([opening_stock_fact(
+                scenario.get("opening_stock", 0), today)]
+                + list(scenario.get("facts", [])), start, last), scale)
+            timeseries = {"day": np.arange(start, last + 1,
+                dtype="datetime64[D]")}
+            for name, values in facts_series(own, N).items():
+                timeseries[name] = series[name] + values
+            if ensemble: # the cumulants of independent facts add up
+                timeseries["ensquant05"], timeseries["ensquant95"] = \
+                    cornish_fisher_quantiles(*[a + b for a, b in
+                        zip(cumulants, analytic_cumulants(own, N))],
+                        bounds = (timeseries["worstcase"],
+                            timeseries["bestcase"]))
+            results.append(timeseries)
+    return results
+
+def timeseries_metrics(timeseries):
+    """ Key figures of a timeseries to compare scenarios
+    Args:
+        timeseries (dict of numpy.ndarray): the timeseries
+    Returns:
+        metrics (dict): the last day as 'end' and for every series the 'final'
+            and 'minimum' value, the day of the minimum and the first day
+            below zero (None if it never gets negative), e.g. 'amount_final'
+    """
+    day = timeseries["day"]
+    metrics = {"end": str(day[-1]) if len(day) else None}
+    for name, values in timeseries.items():
+        if name == "day" or not len(values):
+            continue
+        negative = np.flatnonzero(values < 0)
+        minimum = int(np.argmin(values))
+        metrics.update({
+            "{}_final".format(name): float(values[-1]),
+            "{}_minimum".format(name): float(values[minimum]),
+            "{}_minimum_day".format(name): str(day[minimum]),
+            "{}_below_zero".format(name):
+                str(day[negative[0]]) if len(negative) else None,
+            })
+    return metrics
+
+
+##########################
+### Incremental engine ###
+##########################
+def fact_key(fact, start, end, ensemble_size = None, seed = None):
+    """ Hash a normalized fact row together with the simulation setup
+    Args:
+        fact (dict): the budget fact
+        start, end (numpy.datetime64): the first and last day
+        ensemble_size [Optional(int)]: the ensemble size
+        seed [Optional(int)]: the random seed
+    Returns:
+        key (str): the hexdigest of the hash
+    """
+    row = (fact["frequency"],) + tuple(fact_parameters(fact)) + tuple(
+        str(d) for d in (fact["start"], fact["end"], start, end)) \
+        + (ensemble_size, seed) \
+        + tuple(str(d) for d in fact.get("skip", ()))
+    return hashlib.sha1(repr(row).encode("utf-8")).hexdigest()
+
+def fact_contribution(fact, key, start, end, ensemble_size = None, seed = 0,
+    duplicate = 0):
+    """ Simulate the sparse daily contribution of a single fact. The ensemble
+    draws from a random stream derived from the seed and the fact key, so the
+    contribution does not depend on the other facts.
+    Args:
+        fact (dict): the budget fact
+        key (str): the fact key from fact_key
+        start, end (numpy.datetime64): the first and last day
+        ensemble_size [Optional(int)]: the ensemble size. Defaults to None
+            which means no ensemble.
+        seed [Optional(int)]: the random seed. Defaults to 0.
+        duplicate [Optional(int)]: how many identical facts came before this
+            one in the budget, each of them draws its own ensemble. Defaults
+            to 0.
+    Returns:
+        contribution (dict): the 'parameters' of the fact and the (cells,
+            amounts) to add to the 'amount', 'worstcase', 'bestcase' and
+            'ensemble' sums
+    """
+    N = (end - start).astype(int) + 1
+    indices = fact_indices(fact, start, end)
+    amount, tolerance_amount, tolerance_day = fact_parameters(fact)
+    shift = int(np.sign(amount)) * tolerance_day
+    ones = np.ones(len(indices))
+    contribution = {
+        "parameters": (amount, tolerance_amount, tolerance_day),
+        "amount": (indices, amount * ones),
+        "worstcase": (np.clip(indices + shift, 0, N - 1),
+            (amount - tolerance_amount) * ones),
+        "bestcase": (np.clip(indices - shift, 0, N - 1),
+            (amount + tolerance_amount) * ones),
+        }
+    if ensemble_size:
+        entropy = [seed, int(key[:16], 16)]
+        if duplicate:
+            entropy.append(duplicate)
+        rng = np.random.default_rng(np.random.SeedSequence(entropy))
+        contribution["ensemble"] = draw_ensemble(indices, amount,
+            tolerance_amount, tolerance_day, ensemble_size, N, rng)
+    return contribution
+
+def contribution_size(contribution):
+    """ The memory used by a fact contribution in bytes
+    """
+    return sum(a.nbytes for name, arrays in contribution.items()
+        if name != "parameters" for a in arrays)
+
+class BudgetSimulator(object):
+    """ Simulate budgets incrementally. The sparse daily contribution of every
+    fact is cached and the sums of the last simulation are kept, so that after
+    an edit only the contributions of the changed facts are subtracted and
+    added again before cumulating.
+    """
+    def __init__(self, cache_size = 128 * 2 ** 20):
+        """ class constructor
+        Args:
+            cache_size [Optional(int)]: the maximum memory in bytes used to
+                cache fact contributions. Defaults to 128MiB.
+        """
+        self.cache = utils.LRUCache(maxsize = cache_size,
+            sizeof = contribution_size)
+        # the seed used if none is given, fixed for the lifetime of the
+        # simulator so that cached contributions stay valid
+        self.default_seed = int(np.random.SeedSequence().entropy % 2 ** 32)
+        self.reset()
+
+    def reset(self):
+        """ Forget the sums of the last simulation
+        """
+        self.setup = None
+        self.keys = collections.Counter()
+        self.facts = {}
+        self.sums = {}
+
+    def contribution(self, key, fact):
+        """ Get a fact contribution from the cache or simulate it
+        Args:
+            key (tuple): the fact key and the number of identical facts
+                before it, see fact_contribution
+            fact (dict): the budget fact
+        Returns:
+            contribution (dict): the contribution from fact_contribution
+        """
+        contribution = self.cache.get(key)
+        if contribution is None:
+            start, end, ensemble_size, seed = self.setup
+            contribution = fact_contribution(fact, key[0], start = start,
+                end = end, ensemble_size = ensemble_size, seed = seed,
+                duplicate = key[1])
+            self.cache[key] = contribution
+        return contribution
+
+    def apply(self, key, fact, factor):
+        """ Add a fact contribution to the sums
+        Args:
+            key (tuple): the key of the contribution
+            fact (dict): the budget fact
+            factor (int): how often to add the contribution, negative to
+                subtract it
+        """
+        contribution = self.contribution(key, fact)
+        for name, sums in self.sums.items():
+            cells, amounts = contribution[name]
+            np.add.at(sums.reshape(-1), cells, factor * amounts)
+
+    def timeseries_from_budget(self, budget, start, end, ensemble_size = None,
+        seed = None, ensemble_chunk_size = None, ensemble_bins = 256,
+        workers = 1, executor = "thread", ensemble_mode = "montecarlo",
+        resolution = "day", timer = None):
+        """ Simulate a budget incrementally. The arguments and return value
+        are the same as for timeseries_from_budget. The ensemble is only
+        cached and updated incrementally when it is kept in memory, simulated
+        with a single worker and at daily resolution. Otherwise only the
+        deterministic series are updated incrementally.
+        """
+        start = np.datetime64(start,"D")
+        end = np.datetime64(end,"D")
+        if start > end:
+            raise ValueError(_("start date {} is after end date {}").format(
+                start, end))
+        days = np.arange(start, end + 1, dtype="datetime64[D]")
+        N = len(days)
+        buckets = resolution_buckets(days, resolution)
+        if seed is None: seed = self.default_seed
+        use_ensemble = ensemble_size is not None and ensemble_size > 0
+        analytic = use_ensemble and ensemble_mode == "analytic"
+        incremental_ensemble = use_ensemble and not ensemble_chunk_size \
+            and workers <= 1 and not analytic and buckets is None
+        setup = (start, end, ensemble_size if incremental_ensemble else None,
+            seed)
+        if setup != self.setup: # start from scratch
+            self.reset()
+            self.setup = setup
+            self.sums = {name: np.zeros(N) for name in
+                ("amount","worstcase","bestcase")}
+            if incremental_ensemble:
+                self.sums["ensemble"] = np.zeros((ensemble_size, N))
+
+        # find out which facts changed
+        with stage(timer, "occurrences"):
+            # identical facts are told apart to draw independently
+            budget_keys, duplicates = [], collections.Counter()
+            for fact in budget:
+                key = fact_key(fact, *setup)
+                budget_keys.append((key, duplicates[key]))
+                duplicates[key] += 1
+            facts = dict(zip(budget_keys, budget))
+            keys = collections.Counter(budget_keys)
+            for key, count in (self.keys - keys).items(): # removed facts
+                self.apply(key, self.facts[key], -count)
+            for key, count in (keys - self.keys).items(): # added facts
+                self.apply(key, facts[key], count)
+            self.keys, self.facts = keys, facts
+
+        # cumulate
+        timeseries = {"day": days}
+        for name in ("amount","worstcase","bestcase"):
+            timeseries[name] = np.cumsum(self.sums[name])
+        # ensemble
+        if incremental_ensemble:
+            with stage(timer, "ensemble"):
+                ensemble = np.cumsum(self.sums["ensemble"], axis = 1)
+            with stage(timer, "quantiles"):
+                timeseries["ensquant05"], timeseries["ensquant95"] = \
+                    np.quantile(ensemble, [0.05, 0.95], axis = 0)
+        elif use_ensemble:
+            facts = []
+            for key in keys.elements():
+                contribution = self.contribution(key, self.facts[key])
+                indices = contribution["amount"][0]
+                if len(indices):
+                    facts.append((indices,) + contribution["parameters"])
+            if analytic:
+                with stage(timer, "quantiles"):
+                    timeseries["ensquant05"], timeseries["ensquant95"] = \
+                        analytic_quantiles(facts, N, bounds = (
+                            timeseries["worstcase"], timeseries["bestcase"]))
+        if buckets is not None: # the values at the end of every period
+            ends = bucket_ends(buckets)
+            timeseries = {name: values[ends]
+                for name, values in timeseries.items()}
+        if use_ensemble and not incremental_ensemble and not analytic:
+            with stage(timer, "ensemble"): # including the quantiles
+                timeseries["ensquant05"], timeseries["ensquant95"] = \
+                    simulate_ensemble(facts, ensemble_size, N, seed = seed,
+                        workers = workers, executor = executor,
+                        chunk_size = ensemble_chunk_size, bins = ensemble_bins,
+                        buckets = buckets)
+        return timeseries
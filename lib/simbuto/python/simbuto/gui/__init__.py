@@ -6,9 +6,9 @@ import re
 import configparser
 import signal
 import datetime
-import hashlib
 import time
 import locale
+import functools
 
 # external modules
 import gi
@@ -22,6 +22,14 @@ from gi.repository import Pango
 # internal modules
 from .. import signalmanager
 from .. import config
+from .. import worker
+from .. import rendercache
+from .. import timing
+from .. import budget
+from .. import engine
+from . import refresh
+from . import plot
+from . import filestate
 from .. import VERSION
 from .. import WithLogger
 
@@ -59,6 +67,63 @@ class SimbutoGui(WithLogger):
         assert isinstance(manager, signalmanager.SignalManager)
         self._signalmanager = manager
 
+    @property
+    def graph_worker(self):
+        """ The background worker creating the graphs. Its results are
+        installed from the GLib main loop.
+        """
+        try:
+            return self._graph_worker
+        except AttributeError:
+            self._graph_worker = worker.LatestWinsWorker(
+                dispatch = GLib.idle_add)
+            self._graph_worker.logger = self.logger
+            return self._graph_worker
+
+    @property
+    def refresh_scheduler(self):
+        """ The scheduler all graph refresh requests go through
+        """
+        try:
+            return self._refresh_scheduler
+        except AttributeError:
+            self._refresh_scheduler = refresh.RefreshScheduler(
+                inputs = self.graph_inputs,
+                refresh = self.create_graph,
+                debounce = self.config.getint("gui-plot","refresh_debounce",
+                    fallback=200),
+                latency_budget = self.config.getint("gui-plot",
+                    "latency_budget",fallback=500),
+                )
+            self._refresh_scheduler.logger = self.logger
+            return self._refresh_scheduler
+
+    @property
+    def render_cache(self):
+        """ The cache of rendered graphs in the plots folder
+        """
+        try:
+            return self._render_cache
+        except AttributeError:
+            self._render_cache = rendercache.RenderCache(
+                directory = os.path.join(config.personal_simbuto_dotfolder(),
+                    "plots"),
+                max_size = self.config.getint("gui-plot","cache_size",
+                    fallback=50) * 2 ** 20,
+                max_age = self.config.getfloat("gui-plot","cache_max_age",
+                    fallback=30) * 24 * 3600,
+                )
+            self._render_cache.logger = self.logger
+            return self._render_cache
+
+    @property
+    def renderer(self):
+        """ How to render the graph, either 'cairo' to draw it in-process or
+        'png' to let R render a png file. Defaults to 'cairo'.
+        """
+        renderer = self.config.get("gui-plot","renderer",fallback="cairo")
+        return renderer.strip().lower()
+
     @property
     def currently_edited_file(self):
         """ The currently edited file
@@ -78,41 +143,47 @@ class SimbutoGui(WithLogger):
         # put the file basename into the title
         self.update_window_title_filename()
 
+    @property
+    def file_state(self):
+        """ The filestate.FileStateTracker of the editor buffer
+        """
+        try:
+            return self._file_state
+        except AttributeError:
+            self._file_state = filestate.FileStateTracker(
+                textbuffer = self("texteditor_textview").get_buffer(),
+                external_change = self.on_file_changed_externally)
+            self._file_state.logger = self.logger
+            return self._file_state
+
+    @property
+    def budget_model(self):
+        """ The budget.BudgetModel mirroring the editor buffer. It is updated
+        with every insertion and deletion and only parses the touched lines.
+        """
+        try:
+            return self._budget_model
+        except AttributeError:
+            textbuffer = self("texteditor_textview").get_buffer()
+            self._budget_model = budget.BudgetModel(
+                self.current_editor_content)
+            self._budget_model.logger = self.logger
+            # before the default handlers, the iters are still valid
+            textbuffer.connect("insert-text", self.on_editor_insert_text)
+            textbuffer.connect("delete-range", self.on_editor_delete_range)
+            return self._budget_model
+
     @property
     def budget_needs_saving(self):
         """ Check if the current budget needs saving
         """
-        # no drama here
-        if self.currently_edited_file is None \
-            and self.current_editor_content == "":
-            self.logger.debug(_("The current buffer is empty and no file is"
-                                " specified. No saving necessary."))
-            return False
-
-        # needs saving if no filename was specified yet or file doesn't exist
-        try: assert os.path.exists(self.currently_edited_file) == True
-        except: 
-            self.logger.debug(_(
-            "Nonexistant or no file specified. Saving necessary!"))
-            return True
-
-        # let the manager hash the file
-        res = self.signalmanager.emit_signal("md5sum-of-file",
-            filename=self.currently_edited_file) 
-        md5_file = res[0] # TODO: This is a little insecure
-        self.logger.debug(_("md5sum of file '{}' is '{}'").format(
-            self.currently_edited_file,md5_file))
-        # hash the editor text
-        md5_buffer = hashlib.md5(
-            self.current_editor_content.encode('utf8')).hexdigest() 
-        self.logger.debug(_("md5sum of editor content is '{}'").format(
-            md5_buffer))
-        needs_saving = md5_file != md5_buffer 
+        needs_saving = self.file_state.needs_saving(
+            text = lambda: self.current_editor_content)
         if needs_saving:
             self.logger.debug(_("The current budget would need saving."))
         else:
             self.logger.debug(_("The current budget doesn't need saving."))
-        return needs_saving # return true if different
+        return needs_saving
         
     @property
     def current_editor_content(self):
@@ -122,6 +193,20 @@ class SimbutoGui(WithLogger):
         content = tb.get_text(start, end, True)
         return content
 
+    @property
+    def graph_resolution(self):
+        """ The configured resolution of the graph. 'auto' picks a coarser
+        resolution the farther the selected end date is away.
+        Returns:
+            resolution (str): 'day', 'week' or 'month'
+        """
+        resolution = self.config.get("engine","resolution",
+            fallback="auto").strip().lower()
+        if resolution == "auto":
+            resolution = engine.auto_resolution(datetime.date.today(),
+                self.selected_end_date.date())
+        return resolution
+
     @property
     def selected_end_date(self):
         """ The selected end date. You may set this to a datetime.datetime
@@ -159,58 +244,6 @@ class SimbutoGui(WithLogger):
     def calendar_setting_in_progress(self, value):
         self._calendar_setting_in_progress = bool(value)
 
-    @property
-    def last_window_size_allocate(self):
-        try:
-            return self._last_window_size_allocate
-        except AttributeError:
-            return 0
-
-    @last_window_size_allocate.setter
-    def last_window_size_allocate(self, value):
-        self._last_window_size_allocate = float(value)
-
-    @property
-    def window_resize_is_long_ago(self):
-        return self.last_window_size_allocate + 0.2 < time.time()
-
-    @property
-    def last_window_position(self):
-        try:
-            return self._last_window_position
-        except AttributeError:
-            window = self("main_applicationwindow")
-            pos_old = tuple(window.get_position())
-            return pos_old
-
-    @last_window_position.setter
-    def last_window_position(self, value):
-        self._last_window_position = value
-        
-    @property
-    def last_window_size(self):
-        try:
-            return self._last_window_size
-        except AttributeError:
-            allocation = window.get_allocation()
-            size_old = (allocation.width, allocation.height)
-            return size_old
-
-    @last_window_size.setter
-    def last_window_size(self, value):
-        self._last_window_size = value
-
-    @property
-    def updating_graph_from_editor_is_now_okay(self):
-        try:
-            return self._updating_graph_from_editor_is_now_okay
-        except AttributeError:
-            return True
-
-    @updating_graph_from_editor_is_now_okay.setter
-    def updating_graph_from_editor_is_now_okay(self,value):
-        self._updating_graph_from_editor_is_now_okay = bool(value)
-
     @property
     def current_specified_assets(self):
         amount_str = self("editor_currentassets_entry").get_text()
@@ -368,6 +401,11 @@ class SimbutoGui(WithLogger):
         editor_textview = self("texteditor_textview") # the tv
         monofont = Pango.FontDescription("monospace") # a monospace font
         editor_textview.modify_font(monofont) # set the editor to monospace
+        if self.config.getboolean("gui-plot","live_preview",fallback=True):
+            editor_textview.get_buffer().connect("changed",
+                self.on_editor_changed)
+        self.file_state # start tracking edits
+        self.budget_model # start parsing edits
 
         # current assets
         self("editor_currentassets_entry").set_text("0")
@@ -388,6 +426,11 @@ class SimbutoGui(WithLogger):
         # graph
         plotheading = self("plot_heading_label")
         plotheading.set_text(_("Budget graph"))
+        if self.renderer == "cairo": # replace the image with a drawing area
+            self.plot = plot.BudgetPlot()
+            self.plot.logger = self.logger
+            self("plot_viewport").remove(self("plot_image"))
+            self("plot_viewport").add(self.plot)
 
         # statusbar
         self.reset_statusbar() # initially reset statusbar
@@ -454,6 +497,7 @@ class SimbutoGui(WithLogger):
         textbuffer = textview.get_buffer() # get the underlying buffer
         textbuffer.set_text("") # empty the text
         self.currently_edited_file = None # no file edited currently
+        self.file_state.clear()
 
     def reset_statusbar(self, *args):
         statuslabel = self("status_label")
@@ -475,55 +519,185 @@ class SimbutoGui(WithLogger):
         # set the text
         statuslabel.set_text(newtext)
 
-    def update_graph_from_editor(self, *args, size=None):
-        if self.is_running: # only if gui is running
-            # format the amount
-            self.format_amount_entry(self("editor_currentassets_entry"))
-
-            # rect = self("plot_image").get_allocation()
-            if size is None: # use current size
-                rect = self("plot_scrolledwindow").get_allocation()
-                width = rect.width
-                height = rect.height
-            else: # use given size
-                width, height = size
-
-            try:
-                currentfile = os.path.basename(self.currently_edited_file)
-            except AttributeError:
-                currentfile = _("unnamed-budget")
-
-            cb = self("ensemble_settings_useensemble_checkbutton")
-            use_ensemble = cb.get_active()
-
-            name =  "{}.png".format(currentfile)
-            filename = os.path.join(config.personal_simbuto_dotfolder(),
-                "plots",name)
-            self.update_statusbar(_("updating graph..."))
-            success = self.signalmanager.emit_signal("create-graph-from-text",
-                filename=filename, # to this file
-                text = self.current_editor_content, # this text
-                width = width, height = height, # these dimensions
-                start = datetime.datetime.now(), # start with now
-                end = self.selected_end_date, # this end date
-                use_ensemble = use_ensemble, # use the ensemble or not
-                opening_stock = self.current_specified_assets, # the assets
-                )
-            if success[0]:
-                self.logger.debug(_("The graph file was obviously " 
-                    "sucessfully updated."))
+    def update_graph_from_editor(self, *args):
+        """ Explicitly refresh the graph, even if nothing changed
+        """
+        self.refresh_scheduler.request(reason = "refresh", force = True)
+
+    def graph_inputs(self):
+        """ Collect the inputs for the graph
+        Returns:
+            inputs (dict or None): the keyword arguments for the
+                create-graph-from-text signal except the start time. None if
+                the gui is not running.
+        """
+        if not self.is_running: # only if gui is running
+            return None
+        # format the amount
+        self.format_amount_entry(self("editor_currentassets_entry"))
+
+        rect = self("plot_scrolledwindow").get_allocation()
+
+        cb = self("ensemble_settings_useensemble_checkbutton")
+
+        # reading the buffer is the first stage of the refresh
+        started = time.perf_counter()
+        text = self.budget_model.text
+        self.editor_read_seconds = time.perf_counter() - started
+        inputs = {
+            "text": text, # this text
+            "start_date": datetime.date.today(), # start today
+            "end": self.selected_end_date, # this end date
+            "resolution": self.graph_resolution, # days, weeks or months
+            "use_ensemble": cb.get_active(), # use the ensemble or not
+            "ensemble_size": self.config.getint("engine","ensemble_size",
+                fallback=100), # this many members
+            "opening_stock": self.current_specified_assets, # the assets
+            }
+        if self.renderer == "png": # the png file depends on the size
+            inputs.update(width = rect.width, height = rect.height)
+        return inputs
+
+    def new_timer(self, name):
+        """ Create a timer for a graph refresh
+        Args:
+            name (str): the pipeline name
+        Returns:
+            timer (timing.StageTimer): the timer with the editor reading stage
+        """
+        timer = timing.StageTimer(name)
+        timer.logger = self.logger
+        timer.add("editor", getattr(self, "editor_read_seconds", 0))
+        return timer
+
+    def report_timer(self, timer):
+        """ Log the timings of a graph refresh and show them in the statusbar
+        if configured
+        Args:
+            timer (timing.StageTimer): the timer
+        """
+        timer.log()
+        if self.config.getboolean("gui-plot","show_timings",fallback=False):
+            self.update_statusbar(_("Graph updated: {}").format(
+                timer.summary()))
+
+    def report_budget_errors(self):
+        """ Show the first invalid budget line in the statusbar after a
+        failed refresh
+        """
+        errors = self.budget_model.errors
+        if errors:
+            line, error = errors[0]
+            self.update_statusbar(_("[WARNING] There was a problem "
+                "updating the graph. Line {}: {}").format(line, error))
+        else:
+            self.update_statusbar(_("[WARNING] There was a problem " 
+                "updating the graph. Please check the input!"))
+
+    def create_graph(self, inputs):
+        """ Create the graph in the background, only the newest request wins
+        Args:
+            inputs (dict): the graph inputs from graph_inputs
+        """
+        if self.renderer == "cairo":
+            self.create_timeseries(inputs)
+            return
+        timer = self.new_timer("create-graph-from-text")
+        # the graph is determined by the inputs and the engine settings
+        key = self.render_cache.key(
+            engine = dict(self.config["engine"]) \
+                if self.config.has_section("engine") else {},
+            **inputs)
+        with timer.stage("cache lookup"):
+            filename = self.render_cache.lookup(key)
+        if filename is not None: # display cached graph instantly
+            self.graph_worker.cancel()
+            with timer.stage("display"):
+                self.update_graph_from_file(filename)
+            self.update_statusbar(_("Graph updated"))
+            self.report_timer(timer)
+            return
+        inputs = inputs.copy()
+        inputs.pop("start_date")
+        filename = self.render_cache.path(key)
+        self.update_statusbar(_("updating graph..."))
+        self.graph_worker.submit(
+            functools.partial(self.graph_created,
+                filename = filename, submitted = time.time(), timer = timer),
+            self.signalmanager.emit_signal, "create-graph-from-text",
+            filename = filename, # to this file
+            start = datetime.datetime.now(), # start with now
+            timer = timer, # record the stages
+            **inputs)
+
+    def create_timeseries(self, inputs):
+        """ Simulate the budget in the background to draw it in-process
+        Args:
+            inputs (dict): the graph inputs from graph_inputs
+        """
+        timer = self.new_timer("create-timeseries-from-text")
+        inputs = inputs.copy()
+        inputs.pop("start_date")
+        self.update_statusbar(_("updating graph..."))
+        self.graph_worker.submit(
+            functools.partial(self.timeseries_created,
+                submitted = time.time(), timer = timer),
+            self.signalmanager.emit_signal, "create-timeseries-from-text",
+            start = datetime.datetime.now(), # start with now
+            timer = timer, # record the stages
+            **inputs)
+
+    def timeseries_created(self, results, submitted = None, timer = None):
+        """ Draw a timeseries simulated in the background
+        Args:
+            results (list or None): the results of the
+                create-timeseries-from-text signal, None if it failed
+            submitted [Optional(float)]: the time the graph was requested
+            timer [Optional(timing.StageTimer)]: the timer of the refresh
+        """
+        if submitted is not None:
+            self.refresh_scheduler.finished(time.time() - submitted)
+        if results and results[0] is not None:
+            with timing.stage(timer, "display"):
+                self.plot.set_timeseries(results[0])
+            self.update_statusbar(_("Graph updated"))
+            if timer is not None:
+                self.report_timer(timer)
+        else:
+            self.logger.debug(_("There was a problem updating the graph."))
+            self.report_budget_errors()
+            # don't skip the next refresh with the same inputs
+            self.refresh_scheduler.invalidate()
+
+    def graph_created(self, success, filename, submitted = None,
+        timer = None):
+        """ Install a graph created in the background
+        Args:
+            success (list or None): the results of the create-graph-from-text
+                signal, None if it failed
+            filename (path): the created png file
+            submitted [Optional(float)]: the time the graph was requested
+            timer [Optional(timing.StageTimer)]: the timer of the refresh
+        """
+        if submitted is not None:
+            self.refresh_scheduler.finished(time.time() - submitted)
+        if success and success[0]:
+            self.logger.debug(_("The graph file was obviously " 
+                "sucessfully updated."))
+            with timing.stage(timer, "display"):
                 self.update_graph_from_file(filename)
-                self.update_statusbar(_("Graph updated"))
-            else:
-                self.logger.debug(_("There was a problem updating the graph."))
-                self.update_statusbar(_("[WARNING] There was a problem " 
-                    "updating the graph. Please check the input!"))
-            return True
+            self.update_statusbar(_("Graph updated"))
+            if timer is not None:
+                self.report_timer(timer)
+            self.render_cache.evict()
         else:
-            self.updating_graph_from_editor_is_now_okay = True
-            self.logger.debug(_("The gui is not running. Refusing to update " 
-                "the graph now! Remembering this for gui start."))
-            return False
+            self.logger.debug(_("There was a problem updating the graph."))
+            self.report_budget_errors()
+            # don't skip the next refresh with the same inputs
+            self.refresh_scheduler.invalidate()
+            # don't keep a broken graph in the cache
+            try: os.remove(filename)
+            except OSError: pass
 
 
     def update_graph_from_file(self, filename):
@@ -544,68 +718,36 @@ class SimbutoGui(WithLogger):
         self.logger.debug(_("end date is now {}").format(end_date))
         if start_date < end_date: # correct date selected
             # update the graph
-            self.update_graph_from_editor()
+            self.refresh_scheduler.request(reason = "date")
         else:
             self.logger.debug(_("End date before start date selected."))
             self.update_statusbar(_("You selected an end date in the " 
                 "past. The graph will not updated."))
 
-    def set_update_graph_from_editor_is_now_okay(self):
-        self.updating_graph_from_editor_is_now_okay = True
-        self.logger.debug("graph updating is now okay")
-        return False
-
     def on_window_size_allocate(self,*args):
-        # self.logger.debug("window size-allocate event")
-        if self.updating_graph_from_editor_is_now_okay:
-            self.update_graph_from_editor()
-            self.updating_graph_from_editor_is_now_okay = False
-            # self.logger.debug("from size_allocate: stop graph updating")
-        self.last_window_size_allocate = time.time()
+        # the graph size might have changed
+        self.refresh_scheduler.request(reason = "size-allocate")
 
     def on_configure_event(self,*args):
-        # get old window data
-        window = self("main_applicationwindow")
-        pos_old = tuple(window.get_position())
-        allocation = window.get_allocation()
-        size_old = (allocation.width, allocation.height)
-        # get new data
-        # get the event data
-        eventconfig = args[1] # eventconfigure
-        pos_new = (eventconfig.x, eventconfig.y)
-        size_new = (eventconfig.width, eventconfig.height)
-        # self.logger.debug("size_old: {}, size_new: {}, " 
-        #     "pos_old: {}, pos_new: {}".format(
-        #     size_old,size_new,pos_old,pos_new))
-        # find out action
-        resized = size_old != size_new
-        topleft_position_changed = pos_old != pos_new
-        moving_in_progress = topleft_position_changed and not resized
-        end_of_move = moving_in_progress \
-            and pos_old == self.last_window_position
-        if moving_in_progress: # position changed
-            # self.logger.debug("window is being moved")
-            pass
-        if resized: # position changed
-            # self.logger.debug("window was resized")
-            pass
-        if resized: # resized
-            # self.logger.debug("window was resized")
-            # only after resizing
-            if self.window_resize_is_long_ago: 
-                # update the window # to new size
-                # self.logger.debug("last window resize is long ago")
-                self.set_update_graph_from_editor_is_now_okay()
-        if end_of_move:
-            # self.logger.debug("end of window movement")
-            if self.window_resize_is_long_ago: 
-                # update the window # to new size
-                # self.logger.debug("last window resize is long ago")
-                self.update_graph_from_editor()
-            self.last_window_size_allocate = time.time()
-                
-        self.last_window_position = pos_old
-        self.last_window_size = size_old
+        # the graph size might have changed
+        self.refresh_scheduler.request(reason = "configure")
+        return False # propagate the event
+
+    def on_editor_insert_text(self, textbuffer, location, text, length):
+        self.budget_model.insert(location.get_line(),
+            location.get_line_offset(), text)
+
+    def on_editor_delete_range(self, textbuffer, start, end):
+        self.budget_model.delete(start.get_line(), start.get_line_offset(),
+            end.get_line(), end.get_line_offset())
+
+    def on_editor_changed(self, *args):
+        # live preview while typing
+        self.refresh_scheduler.request(reason = "edit", typing = True)
+
+    def on_file_changed_externally(self, filename):
+        self.update_statusbar(_("[WARNING] The file '{}' was changed by "
+            "another program!").format(filename))
 
 
     ###############
@@ -716,12 +858,14 @@ class SimbutoGui(WithLogger):
         self.logger.info(_("Saving the current budget to the file '{}'..."
             ).format(filename))
         # emit the save-to-file signal
+        text = self.current_editor_content
         res = self.signalmanager.emit_signal("save-to-file",
-            filename=filename,text=self.current_editor_content)
+            filename=filename,text=text)
         if res == [True]:
             self.logger.info(_("Budget saved to '{}'").format(filename))
             self.currently_edited_file = filename # update currently edited file
-            self("app.refresh").activate() # refresh
+            self.file_state.track(filename, text)
+            self.refresh_scheduler.request(reason = "save") # refresh
             self.update_statusbar(_("Budget saved to '{}'").format(filename))
         else:
             self.logger.info(_("Budget could NOT be saved to '{}'!").format(
@@ -749,7 +893,8 @@ class SimbutoGui(WithLogger):
             self.logger.debug(_("editor was filled with contents of file '{}'"
                 ).format(filename))
             self.currently_edited_file = filename # set currently edited file
-            self("app.refresh").activate() # refresh
+            self.file_state.track(filename, text)
+            self.refresh_scheduler.request(reason = "open") # refresh
         else: # didn't work, empty editor
             self.logger.warning(_("Reading from file '{}' didn't work!").format(
                 filename))
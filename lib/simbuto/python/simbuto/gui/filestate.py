@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+# system modules
+import os
+import hashlib
+
+# external modules
+from gi.repository import Gio
+
+# internal modules
+from .. import WithLogger
+
+
+def text_hash(text):
+    """ The md5 hexdigest of a text encoded in utf-8
+    Args:
+        text (str): the text
+    Returns:
+        md5sum (str): the hexdigest
+    """
+    return hashlib.md5(text.encode("utf-8")).hexdigest()
+
+
+class FileStateTracker(WithLogger):
+    """ Keep track of whether the editor content differs from the edited file
+    without reading the file again. The state of the file is recorded when it
+    is loaded or saved, edits in the buffer set a dirty flag and a
+    Gio.FileMonitor notices modifications by other programs.
+    """
+    def __init__(self, textbuffer, external_change = None):
+        """ class constructor
+        Args:
+            textbuffer (Gtk.TextBuffer): the editor buffer
+            external_change [Optional(callable)]: called with the filename
+                when the file was modified, moved or deleted by someone else
+        """
+        self.textbuffer = textbuffer
+        self.external_change = external_change
+        self.filename = None
+        self.saved_hash = text_hash("")
+        self.saved_stat = None
+        self.dirty = False
+        self.externally_modified = False
+        self.monitor = None
+        self.textbuffer.connect("changed", self.on_buffer_changed)
+
+    ### methods ###
+    def file_stat(self):
+        """ The modification time and size of the file
+        Returns:
+            stat (tuple or None): mtime in nanoseconds and size. None if the
+                file doesn't exist.
+        """
+        try:
+            stat = os.stat(self.filename)
+        except (OSError, TypeError):
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def track(self, filename, text):
+        """ Record that the buffer and the file now have the same content.
+        Call this after loading or saving.
+        Args:
+            filename (path): the file
+            text (str): the content of the file and the buffer
+        """
+        if filename != self.filename:
+            self.watch(filename)
+        self.filename = filename
+        self.saved_hash = text_hash(text)
+        self.saved_stat = self.file_stat()
+        self.dirty = False
+        self.externally_modified = False
+        self.logger.debug(_("Tracking file '{}' with md5sum '{}'").format(
+            filename, self.saved_hash))
+
+    def clear(self):
+        """ Stop tracking a file, the buffer is an empty new budget
+        """
+        self.watch(None)
+        self.filename = None
+        self.saved_hash = text_hash("")
+        self.saved_stat = None
+        self.dirty = False
+        self.externally_modified = False
+
+    def watch(self, filename):
+        """ Monitor a file for changes by others
+        Args:
+            filename (path or None): the file, None to stop monitoring
+        """
+        if self.monitor is not None:
+            self.monitor.cancel()
+            self.monitor = None
+        if filename is None:
+            return
+        try:
+            self.monitor = Gio.File.new_for_path(filename).monitor_file(
+                Gio.FileMonitorFlags.WATCH_MOVES, None)
+            self.monitor.connect("changed", self.on_file_changed)
+        except Exception as e: # GLib.Error
+            self.logger.warning(_("Can't monitor file '{}': {}").format(
+                filename, e))
+
+    def needs_saving(self, text):
+        """ Check if the buffer content would need saving
+        Args:
+            text (callable): function returning the buffer content, only
+                called if the buffer was edited
+        Returns:
+            needs_saving (bool): True if the content differs from the file or
+                the file is gone or was modified by someone else
+        """
+        if self.filename is None:
+            return self.dirty and text() != ""
+        if self.externally_modified or self.saved_stat is None:
+            return True
+        if not self.dirty:
+            return False
+        # edits might have been undone
+        needs_saving = text_hash(text()) != self.saved_hash
+        if not needs_saving:
+            self.dirty = False
+        return needs_saving
+
+    ### signal handlers ###
+    def on_buffer_changed(self, *args):
+        self.dirty = True
+
+    def on_file_changed(self, monitor, gfile, other_file, event):
+        if event not in (Gio.FileMonitorEvent.CHANGES_DONE_HINT,
+            Gio.FileMonitorEvent.DELETED, Gio.FileMonitorEvent.MOVED_OUT,
+            Gio.FileMonitorEvent.RENAMED, Gio.FileMonitorEvent.CREATED,
+            Gio.FileMonitorEvent.ATTRIBUTE_CHANGED):
+            return
+        if self.file_stat() == self.saved_stat:
+            return # our own save or nothing relevant changed
+        self.logger.info(_("File '{}' was changed by someone else").format(
+            self.filename))
+        self.externally_modified = True
+        if callable(self.external_change):
+            self.external_change(self.filename)
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+# system modules
+import math
+import locale
+import datetime
+
+# external modules
+import gi
+gi.require_version('Gtk','3.0')
+from gi.repository import Gtk
+import numpy as np
+
+# internal modules
+from .. import WithLogger
+from ..decimation import minmax_indices
+
+# the polygons to draw, lower and upper series
+BANDS = [
+    ("worstcase", "bestcase"),
+    ("ensmin", "ensmax"),
+    ("ensquant05", "ensquant95"),
+    ("ensquant10", "ensquant90"),
+    ("ensquant25", "ensquant75"),
+    ]
+
+# the colored background regions, upper and lower limit and rgba color
+REGIONS = [
+    (math.inf, 500, (0, 1, 0, 0x33 / 255)), # good
+    (500, 0, (1, 1, 0, 0x33 / 255)), # middle
+    (0, -math.inf, (1, 0, 0, 0x99 / 255)), # bad
+    ]
+
+
+def pretty_ticks(lower, upper, n = 5):
+    """ Nice tick values like R's pretty()
+    Args:
+        lower, upper (float): the range
+        n [Optional(int)]: the desired number of intervals. Defaults to 5.
+    Returns:
+        ticks (list of float): the ticks within the range
+    """
+    span = upper - lower
+    if not span > 0:
+        return [lower]
+    raw = span / n
+    magnitude = 10 ** math.floor(math.log10(raw))
+    step = min((m * magnitude for m in (1, 2, 5, 10)
+        if m * magnitude >= raw), default = raw)
+    first = math.ceil(lower / step)
+    last = math.floor(upper / step)
+    return [i * step for i in range(first, last + 1)]
+
+def date_ticks(first, last, n = 6):
+    """ Nice date ticks at the beginning of days, months or years
+    Args:
+        first, last (numpy.datetime64): the date range
+        n [Optional(int)]: the desired maximum number of ticks. Defaults to 6.
+    Returns:
+        ticks (numpy.ndarray of numpy.datetime64): the ticks
+    """
+    for unit, steps in (("D", (1, 2, 7, 14)), ("M", (1, 2, 3, 6)),
+        ("Y", (1, 2, 5, 10, 20, 50))):
+        for step in steps:
+            start = first.astype("datetime64[{}]".format(unit))
+            ticks = np.arange(start, last.astype(
+                "datetime64[{}]".format(unit)) + 1, step).astype("datetime64[D]")
+            ticks = ticks[(ticks >= first) & (ticks <= last)]
+            if len(ticks) <= n:
+                return ticks
+    return np.array([first, last])
+
+
+class BudgetPlot(Gtk.DrawingArea, WithLogger):
+    """ Draw a budget timeseries with Cairo like the R function
+    plot_budget_timeseries does. Redrawing only uses the cached series.
+    """
+    margin = {"left": 80, "right": 15, "top": 30, "bottom": 30}
+
+    def __init__(self):
+        super().__init__()
+        self.timeseries = None
+        self.connect("draw", self.on_draw)
+
+    ### methods ###
+    def set_timeseries(self, timeseries):
+        """ Set the timeseries to draw and redraw
+        Args:
+            timeseries (dict of numpy.ndarray or None): the timeseries as from
+                engine.timeseries_from_budget
+        """
+        self.timeseries = timeseries
+        self.queue_draw()
+
+    def on_draw(self, widget, cr):
+        """ Draw the timeseries on the Cairo context
+        """
+        ts = self.timeseries
+        width = self.get_allocated_width()
+        height = self.get_allocated_height()
+        # white background
+        cr.set_source_rgb(1, 1, 1)
+        cr.paint()
+        if ts is None or not len(ts["day"]):
+            return False
+
+        # the plot area
+        m = self.margin
+        left, top = m["left"], m["top"]
+        right, bottom = width - m["right"], height - m["bottom"]
+        if right <= left or bottom <= top:
+            return False
+        days = ts["day"]
+        x = (days - days[0]).astype(float)
+        xmax = max(x[-1], 1)
+        values = np.concatenate([ts[name] for name in ts if name != "day"])
+        ymin, ymax = np.nanmin(values), np.nanmax(values)
+        if ymin == ymax:
+            ymin, ymax = ymin - 1, ymax + 1
+        # R adds 4% on each side
+        pad = (ymax - ymin) * 0.04
+        ymin, ymax = ymin - pad, ymax + pad
+        def px(v): return left + v / xmax * (right - left)
+        def py(v): return bottom - (v - ymin) / (ymax - ymin) * (bottom - top)
+        def points(name): # at most two points per pixel column
+            indices = minmax_indices(ts[name], right - left)
+            return px(x[indices]), py(ts[name][indices])
+
+        cr.save()
+        cr.rectangle(left, top, right - left, bottom - top)
+        cr.clip()
+        # colored regions
+        for upper, lower, color in REGIONS:
+            y1 = py(min(upper, ymax))
+            y2 = py(max(lower, ymin))
+            if y2 > y1:
+                cr.set_source_rgba(*color)
+                cr.rectangle(left, y1, right - left, y2 - y1)
+                cr.fill()
+        # grid
+        yticks = pretty_ticks(ymin, ymax)
+        xticks = date_ticks(days[0], days[-1])
+        cr.set_source_rgb(0.66, 0.66, 0.66) # darkgray
+        cr.set_line_width(1)
+        cr.set_dash([4, 4])
+        for tick in yticks:
+            cr.move_to(left, py(tick))
+            cr.line_to(right, py(tick))
+        for tick in xticks:
+            xt = px((tick - days[0]).astype(float))
+            cr.move_to(xt, top)
+            cr.line_to(xt, bottom)
+        cr.stroke()
+        cr.set_dash([])
+        # zero line
+        cr.set_source_rgb(0, 0, 0)
+        cr.move_to(left, py(0))
+        cr.line_to(right, py(0))
+        cr.stroke()
+        # bands
+        for lower, upper in BANDS:
+            if lower in ts and upper in ts:
+                cr.set_source_rgba(0, 0, 0, 0x33 / 255)
+                self.polygon(cr, points(lower), points(upper))
+                cr.fill()
+        # ensemble mean
+        if "ensmean" in ts:
+            cr.set_line_width(2)
+            cr.set_dash([6, 6])
+            self.line(cr, *points("ensmean"))
+            cr.stroke()
+            cr.set_dash([])
+        # raw run
+        cr.set_line_width(4)
+        self.line(cr, *points("amount"))
+        cr.stroke()
+        cr.restore()
+
+        # frame, axes and title
+        cr.set_source_rgb(0, 0, 0)
+        cr.set_line_width(1)
+        cr.rectangle(left, top, right - left, bottom - top)
+        cr.stroke()
+        cr.set_font_size(12)
+        for tick in yticks:
+            label = locale.format_string("%.10g", tick, grouping = True)
+            extents = cr.text_extents(label)
+            cr.move_to(left - extents.width - 8,
+                py(tick) + extents.height / 2)
+            cr.show_text(label)
+        for tick in xticks:
+            label = tick.astype(datetime.date).strftime("%x")
+            extents = cr.text_extents(label)
+            cr.move_to(px((tick - days[0]).astype(float)) - extents.width / 2,
+                bottom + extents.height + 8)
+            cr.show_text(label)
+        title = "{}  -  {}".format(days[0], days[-1])
+        cr.set_font_size(14)
+        extents = cr.text_extents(title)
+        cr.move_to((left + right - extents.width) / 2, top - 10)
+        cr.show_text(title)
+        return False
+
+    def line(self, cr, x, y):
+        """ Add a line path through the points
+        """
+        cr.move_to(x[0], y[0])
+        for xi, yi in zip(x[1:], y[1:]):
+            cr.line_to(xi, yi)
+
+    def polygon(self, cr, lower, upper):
+        """ Add a closed path between a lower and an upper line, each given as
+        (x, y) points
+        """
+        self.line(cr, *lower)
+        x, y = upper
+        for xi, yi in zip(x[::-1], y[::-1]):
+            cr.line_to(xi, yi)
+        cr.close_path()
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+# system modules
+
+# external modules
+from gi.repository import GLib
+
+# internal modules
+from .. import WithLogger
+
+
+class RefreshScheduler(WithLogger):
+    """ Coalesce bursts of refresh requests into a single refresh after a
+    debounce time and skip refreshes whose inputs didn't change
+    """
+    def __init__(self, inputs, refresh, debounce = 200, latency_budget = 500):
+        """ class constructor
+        Args:
+            inputs (callable): function returning the current refresh inputs.
+                These are compared to the inputs of the last refresh.
+            refresh (callable): function taking the inputs to refresh
+            debounce [Optional(int)]: the debounce time in milliseconds.
+                Defaults to 200.
+            latency_budget [Optional(int)]: the target latency in milliseconds
+                for refreshes requested while typing. If the last refresh took
+                longer, typing refreshes are delayed by that duration as well.
+                Defaults to 500.
+        """
+        self.inputs = inputs
+        self.refresh = refresh
+        self.debounce = int(debounce)
+        self.latency_budget = int(latency_budget)
+        self.source = None # the pending GLib timeout
+        self.forced = False
+        self.last_inputs = None
+        self.last_duration = 0
+
+    ### methods ###
+    def request(self, reason = None, force = False, typing = False):
+        """ Request a refresh. Requests arriving within the debounce time are
+        coalesced into a single refresh.
+        Args:
+            reason [Optional(str)]: the reason for debugging
+            force [Optional(bool)]: refresh even if the inputs didn't change.
+                Defaults to False.
+            typing [Optional(bool)]: whether the request comes from typing in
+                the editor. Defaults to False.
+        """
+        self.logger.debug(_("Refresh requested ({})").format(reason))
+        self.forced = self.forced or force
+        delay = self.debounce
+        if typing and self.last_duration * 1000 > self.latency_budget:
+            # refreshing is too slow for live preview, wait longer
+            delay += int(self.last_duration * 1000)
+        if self.source is not None:
+            GLib.source_remove(self.source)
+        self.source = GLib.timeout_add(delay, self.run)
+
+    def run(self):
+        """ Run the requested refresh if the inputs changed or it was forced
+        """
+        self.source = None
+        force, self.forced = self.forced, False
+        inputs = self.inputs()
+        if inputs is None:
+            self.logger.debug(_("No inputs to refresh from"))
+        elif inputs == self.last_inputs and not force:
+            self.logger.debug(_("Inputs didn't change, skipping refresh"))
+        else:
+            self.last_inputs = inputs
+            self.refresh(inputs)
+        return False # don't run again
+
+    def invalidate(self):
+        """ Forget the last inputs so that the next refresh is never skipped
+        """
+        self.last_inputs = None
+
+    def finished(self, duration):
+        """ Tell the scheduler how long the last refresh took
+        Args:
+            duration (float): the duration in seconds
+        """
+        self.last_duration = float(duration)
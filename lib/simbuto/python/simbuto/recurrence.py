@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+""" Recurrence rules of budget facts
+
+A frequency is 'once' or an interval like 'month', '2 weeks' or
+'every 3 months', optionally followed by a position within the month like
+'last workday' or 'first day of the month'. The aliases 'daily', 'weekly',
+'fortnightly', 'monthly', 'quarterly' and 'yearly' may be used for the
+interval, e.g. 'quarterly last working day'. A position without interval
+means monthly. Month and year steps keep the day of month of the start and
+are clamped to the end of shorter months. Workdays are Monday to Friday.
+
+The occurences are expanded straight into integer day offsets from the
+start of the simulated date range with a cached index of its months.
+"""
+# system modules
+import re
+import functools
+import collections
+
+# external modules
+import numpy as np
+
+# aliases of the first word of a frequency
+FREQUENCY_ALIASES = {
+    "daily":       "day",
+    "weekly":      "week",
+    "fortnightly": "2 weeks",
+    "monthly":     "month",
+    "quarterly":   "quarter",
+    "yearly":      "year",
+    }
+
+# interval like 'month' or 'every 2 weeks' and position like 'last workday'
+RULE_REGEX = re.compile(
+    r"^\s*(?:every\s+)?(?:(?P<n>\d+)\s+)?"
+    r"(?:(?P<unit>day|week|month|quarter|year)s?)?\s*,?\s*"
+    r"(?:(?P<position>first|last)\s+(?P<day>day|workday|working\s+day)"
+    r"(?:\s+of\s+(?:the\s+)?month)?)?\s*$")
+
+# a parsed frequency: the unit ('once', 'day' or 'month'), the number of
+# units per step and the position within the month ('first day', 'last day',
+# 'first workday', 'last workday' or None for the day of month of the start)
+Rule = collections.namedtuple("Rule", ["unit", "n", "position"])
+
+
+def normalize_frequency(frequency):
+    """ Replace an alias at the beginning of a frequency
+    Args:
+        frequency (str): the frequency
+    Returns:
+        frequency (str): the frequency without alias
+    """
+    words = frequency.strip().split(None, 1)
+    if not words:
+        return ""
+    words[0] = FREQUENCY_ALIASES.get(words[0], words[0])
+    return " ".join(words)
+
+@functools.lru_cache(maxsize = 256)
+def parse_rule(frequency):
+    """ Parse a frequency
+    Args:
+        frequency (str): the frequency without alias
+    Returns:
+        rule (Rule): the recurrence rule
+    Raises:
+        ValueError: if the frequency is not understood
+    """
+    if frequency == "once":
+        return Rule("once", 1, None)
+    match = RULE_REGEX.match(frequency)
+    if not match or not (match.group("unit") or match.group("position")) \
+        or (match.group("n") and not match.group("unit")):
+        raise ValueError(_("invalid frequency '{}'").format(frequency))
+    unit = match.group("unit") or "month"
+    n = int(match.group("n") or 1)
+    if n < 1:
+        raise ValueError(_("invalid frequency '{}'").format(frequency))
+    # weeks are steps of days, quarters and years steps of months
+    units = {"week": ("day", 7), "quarter": ("month", 3),
+        "year": ("month", 12)}
+    if unit in units:
+        unit, factor = units[unit]
+        n *= factor
+    position = None
+    if match.group("position"):
+        if unit != "month":
+            raise ValueError(_("invalid frequency '{}'").format(frequency))
+        position = "{} {}".format(match.group("position"),
+            "day" if match.group("day") == "day" else "workday")
+    return Rule(unit, n, position)
+
+
+class Calendar(object):
+    """ Index of the months of a date range as day offsets from its start
+    """
+    def __init__(self, start, end):
+        """ class constructor
+        Args:
+            start, end (numpy.datetime64): the first and last day
+        """
+        self.start = start
+        self.N = int((end - start).astype(int)) + 1
+        self.months = np.arange(start.astype("datetime64[M]"),
+            end.astype("datetime64[M]") + 1)
+        first = self.months.astype("datetime64[D]")
+        self.length = ((self.months + 1).astype("datetime64[D]")
+            - first).astype(int)
+        last = first + self.length - 1
+        # negative for the month of the start
+        self.first = (first - start).astype(int)
+        self.first_workday = (np.busday_offset(first, 0, roll = "forward")
+            - start).astype(int)
+        self.last_workday = (np.busday_offset(last, 0, roll = "backward")
+            - start).astype(int)
+
+    ### methods ###
+    def offset(self, date):
+        """ The day offset of a date
+        Args:
+            date (numpy.datetime64): the date
+        Returns:
+            offset (int): the number of days since the start
+        """
+        return int((date - self.start).astype(int))
+
+    def month_days(self, origin, n, position = None):
+        """ The day offsets of a monthly rule in all months of the index
+        Args:
+            origin (numpy.datetime64): the first occurence, its month is the
+                first month and its day of month is kept if position is None
+            n (int): the number of months per step
+            position [Optional(str)]: the position within the month, see Rule
+        Returns:
+            offsets (numpy.ndarray of int): the day offsets
+        """
+        origin_month = origin.astype("datetime64[M]")
+        since = (self.months - origin_month).astype(int)
+        select = (since >= 0) & (since % n == 0)
+        if position == "first day":
+            return self.first[select]
+        if position == "last day":
+            return self.first[select] + self.length[select] - 1
+        if position == "first workday":
+            return self.first_workday[select]
+        if position == "last workday":
+            return self.last_workday[select]
+        # the day of month of the origin, clamped to the month end
+        day = int((origin - origin_month.astype("datetime64[D]")).astype(int))
+        return self.first[select] + np.minimum(day, self.length[select] - 1)
+
+@functools.lru_cache(maxsize = 8)
+def calendar(start, end):
+    """ The cached Calendar of a date range
+    Args:
+        start, end (numpy.datetime64): the first and last day
+    Returns:
+        calendar (Calendar): the calendar
+    """
+    return Calendar(start, end)
+
+def occurence_offsets(frequency, first, last, start, end, skip = None):
+    """ The day offsets of the occurences of a recurrence rule
+    Args:
+        frequency (str): the frequency without alias
+        first, last (numpy.datetime64): the first and last possible day of
+            the occurences
+        start, end (numpy.datetime64): the first and last day of the date
+            range
+        skip [Optional(numpy.ndarray of numpy.datetime64)]: days without
+            occurence
+    Returns:
+        offsets (numpy.ndarray of int): the ascending offsets of the
+            occurences within the date range from its start
+    Raises:
+        ValueError: if the frequency is not understood
+    """
+    rule = parse_rule(frequency)
+    index = calendar(start, end)
+    origin = index.offset(first)
+    lower = max(origin, 0)
+    upper = min(index.offset(last), index.N - 1)
+    if rule.unit == "once":
+        offsets = np.array([origin] if 0 <= origin < index.N else [],
+            dtype = int)
+    elif rule.unit == "day":
+        # the first step within the date range
+        steps = max(-(-(lower - origin) // rule.n), 0)
+        offsets = np.arange(origin + steps * rule.n, upper + 1, rule.n)
+    else:
+        offsets = index.month_days(first, rule.n, rule.position)
+        offsets = offsets[(offsets >= lower) & (offsets <= upper)]
+    if skip is not None and len(skip):
+        skip = skip[~np.isnat(skip)]
+        offsets = offsets[~np.isin(offsets, (skip - start).astype(int))]
+    return offsets.astype(int)
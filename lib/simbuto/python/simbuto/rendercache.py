@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# system modules
+import os
+import re
+import time
+import hashlib
+
+# internal modules
+from . import WithLogger
+
+# render cache class
+class RenderCache(WithLogger):
+    """ Content-addressed cache of rendered graphs. The files are named after
+    the hash of all inputs that influence the graph.
+    """
+    def __init__(self, directory, max_size = 50 * 2 ** 20,
+        max_age = 30 * 24 * 3600, extension = "png"):
+        """ class constructor
+        Args:
+            directory (path): the directory to store the files in
+            max_size [Optional(int)]: the maximum total size of the cached
+                files in bytes. Defaults to 50MiB.
+            max_age [Optional(float)]: the maximum age in seconds since a cached
+                file was last used. Defaults to 30 days.
+            extension [Optional(str)]: the file extension. Defaults to 'png'.
+        """
+        self.directory = directory
+        self.max_size = max_size
+        self.max_age = max_age
+        self.extension = extension
+        self.regex = re.compile(r"^[0-9a-f]{40}\." + re.escape(extension) + "$")
+
+    ### methods ###
+    def key(self, **inputs):
+        """ Hash the inputs of a graph
+        Args:
+            inputs (keyword arguments): everything that influences the graph
+        Returns:
+            key (str): the hexdigest of the hash
+        """
+        text = repr(sorted(inputs.items()))
+        return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+    def path(self, key):
+        """ The path of a cached file
+        Args:
+            key (str): the key from key()
+        Returns:
+            path (str): the path of the file
+        """
+        return os.path.join(self.directory, "{}.{}".format(key, self.extension))
+
+    def lookup(self, key):
+        """ Look up a cached file and mark it as recently used
+        Args:
+            key (str): the key from key()
+        Returns:
+            path (str or None): the path of the cached file or None if it is not
+                cached
+        """
+        path = self.path(key)
+        try:
+            os.utime(path) # mark as recently used
+        except OSError:
+            self.logger.debug(_("Render cache miss for '{}'").format(key))
+            return None
+        self.logger.debug(_("Render cache hit for '{}'").format(key))
+        return path
+
+    def evict(self):
+        """ Remove cached files that were not used for too long and then the
+        least recently used ones until the total size fits
+        """
+        now = time.time()
+        entries = []
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return
+        for name in filter(self.regex.match, names):
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort(reverse = True) # most recently used first
+        total = 0
+        for mtime, size, path in entries:
+            if total + size <= self.max_size and now - mtime <= self.max_age:
+                total += size # keep it
+            else:
+                try:
+                    os.remove(path)
+                    self.logger.debug(_("Evicted '{}' from render cache"
+                        ).format(path))
+                except OSError:
+                    pass
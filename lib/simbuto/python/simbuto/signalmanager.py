@@ -1,14 +1,23 @@
 #!/usr/bin/env python3
 # system modules
 import logging
+import reprlib
+import threading
+import concurrent.futures
 
 # internal modules
 from . import WithLogger
 
+# short representations of signal data for logging
+short_repr = reprlib.Repr()
+short_repr.maxstring = 60
+short_repr.maxother = 60
+
 # signal manager class
 class SignalManager(WithLogger):
     def __init__(self):
         self.signals = {} # start with empty signals
+        self.lock = threading.Lock()
 
     ##################
     ### Properties ###
@@ -25,17 +34,60 @@ class SignalManager(WithLogger):
         assert isinstance(newsignals, dict)
         self._signals = newsignals
 
+    @property
+    def executor(self):
+        """ The concurrent.futures.Executor to run the actions of threaded
+        signals on with emit_signal_async. Defaults to a single worker thread,
+        so that the actions never run concurrently.
+        """
+        with self.lock:
+            try:
+                return self._executor
+            except AttributeError:
+                self._executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers = 1, thread_name_prefix = "signal")
+                return self._executor
+
+    @executor.setter
+    def executor(self, executor):
+        assert isinstance(executor, concurrent.futures.Executor)
+        self._executor = executor
+
+    @property
+    def dispatch(self):
+        """ Function taking a function to run it in the main thread, e.g.
+        GLib.idle_add. The function returns False. Non-threaded signals and the
+        callbacks of emit_signal_async are run with it. Defaults to calling
+        the function directly.
+        """
+        try:
+            return self._dispatch
+        except AttributeError:
+            return lambda f: f()
+
+    @dispatch.setter
+    def dispatch(self, dispatch):
+        assert callable(dispatch)
+        self._dispatch = dispatch
+
     ### methods ###
-    def add_signals(self, names):
+    def add_signals(self, names, threaded = None):
         """ add new signals
         Args:
             names (list of str): Names of the new signals
+            threaded [Optional(bool)]: whether emit_signal_async runs the
+                actions on the executor instead of the main thread. Defaults
+                to None which means to keep the setting of existing signals
+                and False for new signals.
         """
         for name in names: # loop over all names
             if name in self.signals: 
+                if threaded is not None:
+                    self.signals[name]["threaded"] = bool(threaded)
                 continue # if we already have it, allright!
             self.signals[name] = {
                 "actions": [], # empty list of actions
+                "threaded": bool(threaded),
             }
             self.logger.debug(_("Signal '{}' added").format(name))
 
@@ -98,14 +150,61 @@ class SignalManager(WithLogger):
         try:
             signal = self.signals[name]
             actions = signal["actions"]
-            self.logger.debug(_("Signal '{}' emitted with data '{}'"
-                ).format(name, data))
+            debug = self.logger.isEnabledFor(logging.DEBUG)
+            if debug: # only format the data if it is logged
+                self.logger.debug(_("Signal '{}' emitted with data '{}'"
+                    ).format(name, short_repr.repr(data)))
             for action in actions: 
-                self.logger.debug(_("Calling action '{}' with data '{}'"
-                    ).format(action,data))
+                if debug:
+                    self.logger.debug(_("Calling action '{}' with data '{}'"
+                        ).format(action, short_repr.repr(data)))
                 res = action(**data) # call every action
                 results.append(res) # append the return value
         except KeyError:
             self.logger.warning(
                 _("Attempt to emit unregistered signal '{}'").format(name))
         return results
+
+    def emit_signal_async(self, name, callback = None, **data):
+        """ emit a signal without waiting for the actions. The actions of
+        threaded signals run on the executor, the others in the main thread
+        via dispatch.
+        Args:
+            name (str): the signal name
+            callback [Optional(callable)]: called with the list of results
+                via dispatch in the main thread when all actions are done
+            data (keyword arguments): the data passed to all actions
+        Returns:
+            future (concurrent.futures.Future): the future of the list of
+                results
+        """
+        threaded = self.signals.get(name, {}).get("threaded", False)
+        if threaded:
+            future = self.executor.submit(self.emit_signal, name, **data)
+        else:
+            future = concurrent.futures.Future()
+            def run():
+                if future.set_running_or_notify_cancel():
+                    try:
+                        future.set_result(self.emit_signal(name, **data))
+                    except BaseException as e:
+                        future.set_exception(e)
+                return False
+            self.dispatch(run)
+        if callable(callback):
+            def done(future):
+                try:
+                    results = future.result()
+                except (Exception, concurrent.futures.CancelledError) as e:
+                    self.logger.warning(_("Signal '{}' failed: {}").format(
+                        name, e))
+                    results = None
+                def deliver():
+                    callback(results)
+                    return False
+                if threaded:
+                    self.dispatch(deliver)
+                else: # already in the main thread
+                    deliver()
+            future.add_done_callback(done)
+        return future
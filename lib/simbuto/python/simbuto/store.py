@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+""" Columnar binary files for computed forecasts
+
+A forecast file starts with the magic bytes, the length of a JSON header as
+little-endian uint32 and the header itself. The header holds the first day,
+the number of rows, the metadata and the dtype and byte offset of every
+column. The columns follow, each aligned to 8 bytes: 'day' as int32 offsets
+from the first day and the series as float64. Reading memory-maps the file,
+so only the columns and days that are actually used are read from disk.
+"""
+# system modules
+import os
+import json
+import struct
+import tempfile
+
+# external modules
+import numpy as np
+
+MAGIC = b"SIMBUTO-FORECAST1\n"
+ALIGNMENT = 8
+
+
+def write_forecast(filename, timeseries, **metadata):
+    """ Write a timeseries to a forecast file. The file is replaced
+    atomically.
+    Args:
+        filename (path): the forecast file
+        timeseries (dict of numpy.ndarray): the timeseries with a 'day' column
+        metadata (keyword arguments): JSON-serializable information to store
+            in the header, e.g. the simulation inputs
+    """
+    days = np.asarray(timeseries["day"], dtype="datetime64[D]")
+    start = days[0] if len(days) else np.datetime64("1970-01-01","D")
+    arrays = {"day": (days - start).astype("<i4")}
+    for name, values in timeseries.items():
+        if name != "day":
+            arrays[name] = np.asarray(values, dtype="<f8")
+    # the header with placeholder offsets to know its size
+    columns = {name: {"dtype": array.dtype.str, "offset": 0}
+        for name, array in arrays.items()}
+    header = {"start": str(start), "length": len(days), "columns": columns,
+        "metadata": metadata}
+    def encoded(): return json.dumps(header).encode("utf-8")
+    # offsets grow at most by their number of digits, reserve some space
+    size = len(MAGIC) + 4 + len(encoded()) + 20 * len(arrays)
+    offset = -(-size // ALIGNMENT) * ALIGNMENT
+    for name, array in arrays.items():
+        columns[name]["offset"] = offset
+        offset += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+    directory = os.path.dirname(os.path.abspath(filename))
+    fd, tmp = tempfile.mkstemp(dir = directory, suffix = ".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(MAGIC)
+            head = encoded()
+            assert len(MAGIC) + 4 + len(head) <= size # fits before the data
+            f.write(struct.pack("<I", len(head)))
+            f.write(head)
+            for name, array in arrays.items():
+                f.seek(columns[name]["offset"])
+                f.write(array.tobytes())
+            f.truncate(offset)
+        os.replace(tmp, filename)
+    except BaseException:
+        try: os.remove(tmp)
+        except OSError: pass
+        raise
+
+class Forecast(object):
+    """ A memory-mapped forecast file
+    """
+    def __init__(self, filename):
+        """ class constructor
+        Args:
+            filename (path): the forecast file
+        Raises:
+            ValueError: if the file is no forecast file
+            OSError: if the file can't be read
+        """
+        self.filename = filename
+        with open(filename, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(_("'{}' is no forecast file").format(
+                    filename))
+            size, = struct.unpack("<I", f.read(4))
+            self.header = json.loads(f.read(size).decode("utf-8"))
+        self.start = np.datetime64(self.header["start"], "D")
+        self.length = self.header["length"]
+        self.metadata = self.header["metadata"]
+
+    ### properties ###
+    @property
+    def columns(self):
+        """ The names of the columns
+        """
+        return list(self.header["columns"])
+
+    @property
+    def end(self):
+        """ The last stored day
+        """
+        if not self.length:
+            return self.start - 1
+        return self.start + int(self.column("day")[-1])
+
+    ### methods ###
+    def column(self, name):
+        """ Memory-map a column
+        Args:
+            name (str): the column name
+        Returns:
+            values (numpy.memmap): the read-only column
+        """
+        column = self.header["columns"][name]
+        if not self.length:
+            return np.array([], dtype = column["dtype"])
+        return np.memmap(self.filename, dtype = column["dtype"], mode = "r",
+            offset = column["offset"], shape = (self.length,))
+
+    def index(self, start = None, end = None):
+        """ The slice of the rows within a date range. The rows need not be
+        daily, the stored day offsets are searched.
+        Args:
+            start, end [Optional(numpy.datetime64)]: the first and last day.
+                Default to the whole forecast.
+        Returns:
+            selection (slice): the slice into the columns
+        """
+        days = self.column("day")
+        first = 0 if start is None else int(np.searchsorted(days,
+            (np.datetime64(start, "D") - self.start).astype(int), "left"))
+        last = self.length if end is None else int(np.searchsorted(days,
+            (np.datetime64(end, "D") - self.start).astype(int), "right"))
+        return slice(first, max(first, last))
+
+    def timeseries(self, columns = None, start = None, end = None):
+        """ Read a part of the forecast. The day offsets are stored in
+        ascending order, so only the pages of the date range are read.
+        Args:
+            columns [Optional(list of str)]: the columns to read. Defaults to
+                all columns.
+            start, end [Optional(numpy.datetime64)]: the first and last day.
+                Default to the whole forecast.
+        Returns:
+            timeseries (dict of numpy.ndarray): the timeseries with the dates
+                as 'day' column
+        """
+        selection = self.index(start, end)
+        if columns is None:
+            columns = self.columns
+        timeseries = {"day": self.start + np.asarray(
+            self.column("day")[selection], dtype = int)}
+        for name in columns:
+            if name != "day":
+                timeseries[name] = np.array(self.column(name)[selection])
+        return timeseries
+
+def diff_forecasts(old, new, columns = None, start = None, end = None):
+    """ Compare two forecasts on their common days
+    Args:
+        old, new (Forecast): the forecasts
+        columns [Optional(list of str)]: the columns to compare. Defaults to
+            all columns both forecasts have.
+        start, end [Optional(numpy.datetime64)]: limit the date range.
+            Defaults to the common date range.
+    Returns:
+        difference (dict of numpy.ndarray): the 'day' column and new minus
+            old for every compared column
+    """
+    first = max(old.start, new.start)
+    last = min(old.end, new.end)
+    if start is not None: first = max(first, np.datetime64(start, "D"))
+    if end is not None: last = min(last, np.datetime64(end, "D"))
+    if columns is None:
+        columns = [name for name in old.columns
+            if name in new.columns and name != "day"]
+    if first > last:
+        return {"day": np.array([], dtype = "datetime64[D]"),
+            **{name: np.array([]) for name in columns}}
+    a = old.timeseries(columns, first, last)
+    b = new.timeseries(columns, first, last)
+    # the forecasts might have been stored at different resolutions
+    days, ia, ib = np.intersect1d(a["day"], b["day"], assume_unique = True,
+        return_indices = True)
+    difference = {"day": days}
+    for name in columns:
+        difference[name] = b[name][ib] - a[name][ia]
+    return difference
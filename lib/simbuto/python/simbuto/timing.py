@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+# system modules
+import io
+import sys
+import json
+import time
+import pstats
+import logging
+import cProfile
+import threading
+import contextlib
+import tracemalloc
+import collections
+
+# internal modules
+from . import WithLogger
+
+# the running stages of all timers as id: {"shared": bool}, tracemalloc only
+# has one process-wide peak, so it is only read for stages that didn't overlap
+# with others
+_running_stages = {}
+_running_lock = threading.Lock()
+
+def stage(timer, name):
+    """ Time a stage if there is a timer
+    Args:
+        timer (StageTimer or None): the timer
+        name (str): the stage name
+    Returns:
+        context (context manager): timing the stage if there is a timer
+    """
+    if timer is None:
+        return contextlib.nullcontext()
+    return timer.stage(name)
+
+# stage timer class
+class StageTimer(WithLogger):
+    """ Record the wall time of the stages of a pipeline. If tracemalloc is
+    tracing (e.g. with simbuto --trace-allocations), the peak of Python and
+    NumPy allocations during each stage is recorded as well. The peak is
+    process-wide, so it is left out for stages that overlapped with another
+    stage, e.g. of a pipeline in another thread or a nested stage.
+    """
+    def __init__(self, name):
+        """ class constructor
+        Args:
+            name (str): the name of the pipeline
+        """
+        self.name = name
+        self.stages = collections.OrderedDict()
+        self.created = time.perf_counter()
+
+    ### methods ###
+    @contextlib.contextmanager
+    def stage(self, name):
+        """ Context manager timing a stage
+        Args:
+            name (str): the stage name
+        """
+        tracing = tracemalloc.is_tracing()
+        running = {"shared": False}
+        with _running_lock:
+            if _running_stages:
+                running["shared"] = True
+                for other in _running_stages.values():
+                    other["shared"] = True
+            _running_stages[id(running)] = running
+            if tracing and not running["shared"]:
+                before = tracemalloc.get_traced_memory()[0]
+                tracemalloc.reset_peak()
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - started
+            with _running_lock:
+                del _running_stages[id(running)]
+                peak = tracemalloc.get_traced_memory()[1] - before \
+                    if tracing and not running["shared"] else None
+            self.add(name, seconds, peak)
+
+    def add(self, name, seconds, allocated = None):
+        """ Record a stage measured elsewhere. Repeated stages add up.
+        Args:
+            name (str): the stage name
+            seconds (float): the wall time
+            allocated [Optional(int)]: the allocated bytes. Defaults to None
+                which means unknown.
+        """
+        record = self.stages.setdefault(name, {"seconds": 0})
+        record["seconds"] += seconds
+        if allocated is not None:
+            record["allocated"] = max(record.get("allocated", 0), allocated)
+
+    @property
+    def total(self):
+        """ The wall time since the timer was created in seconds
+        """
+        return time.perf_counter() - self.created
+
+    def summary(self):
+        """ A short human-readable summary of the stages
+        Returns:
+            summary (str): e.g. 'parse 3 ms, simulate 40 ms (total 50 ms)'
+        """
+        parts = ["{} {:.0f} ms".format(name, record["seconds"] * 1000)
+            for name, record in self.stages.items()]
+        return _("{} (total {:.0f} ms)").format(", ".join(parts),
+            self.total * 1000)
+
+    def log(self, level = logging.INFO):
+        """ Emit the stages as a structured log record. The record has the
+        attributes 'pipeline', 'stages' and 'total' and the message contains
+        the same data as JSON.
+        Args:
+            level [Optional(int)]: the log level. Defaults to logging.INFO.
+        """
+        data = {"pipeline": self.name, "stages": dict(self.stages),
+            "total": self.total}
+        self.logger.log(level, _("Timings: {}").format(json.dumps(data)),
+            extra = data)
+
+# profile class
+class ThreadProfile(cProfile.Profile):
+    """ A cProfile.Profile that can be read while its thread still runs.
+    Only the thread that enabled a profile can disable it.
+    """
+    def create_stats(self):
+        self.snapshot_stats()
+
+# profiler class
+class Profiler(WithLogger):
+    """ Profile the main thread with cProfile. Before Python 3.12, all threads
+    started afterwards are profiled as well and the results are merged. Since
+    Python 3.12 only one profiler can be active per process, so only the main
+    thread is profiled there.
+    """
+    def __init__(self):
+        self.profiles = []
+        self.main_profile = None
+        self.lock = threading.Lock()
+
+    ### properties ###
+    @property
+    def per_thread(self):
+        """ Whether every thread can have its own profiler
+        """
+        return sys.version_info < (3, 12)
+
+    ### methods ###
+    def start(self):
+        """ Start profiling this and, if possible, all new threads
+        """
+        self.main_profile = self.profile_thread()
+        if self.per_thread:
+            threading.setprofile(self.profile_thread)
+
+    def profile_thread(self, *args):
+        """ Start profiling the current thread. This is installed as
+        threading.setprofile hook to run in every new thread. Profiling never
+        stops a thread, a profile that can't be enabled is left out.
+        Returns:
+            profile (ThreadProfile or None): the enabled profile
+        """
+        profile = ThreadProfile()
+        try:
+            profile.enable() # replaces this hook
+        except ValueError as e: # another profiler is active
+            self.logger.warning(_("Could not profile thread '{}': {}").format(
+                threading.current_thread().name, e))
+            return None
+        with self.lock:
+            self.profiles.append(profile)
+        return profile
+
+    def stop(self):
+        """ Stop profiling the current thread and new threads. Threads that
+        are still running keep their profiler until they end.
+        """
+        threading.setprofile(None)
+        if self.main_profile is not None:
+            self.main_profile.disable()
+
+    def stats(self, sort = "cumulative", limit = 40):
+        """ The merged statistics of all threads
+        Args:
+            sort [Optional(str)]: the pstats sort key. Defaults to
+                'cumulative'.
+            limit [Optional(int)]: the number of functions to list. Defaults
+                to 40.
+        Returns:
+            stats, text (pstats.Stats, str): the statistics and a listing
+        """
+        stream = io.StringIO()
+        with self.lock:
+            stats = pstats.Stats(*self.profiles, stream = stream)
+        stats.sort_stats(sort).print_stats(limit)
+        return stats, stream.getvalue()
@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 import os
 import re
+import collections
 
 # split a path into its components
 def splitpath(path):
@@ -17,3 +18,46 @@ def splitpath(path):
     return res
 
 
+class LRUCache(collections.OrderedDict):
+    """ Dict that evicts the least recently used items when the summed size of
+    its values exceeds a limit
+    """
+    def __init__(self, maxsize, sizeof = lambda value: 1):
+        """ class constructor
+        Args:
+            maxsize (int): the maximum summed size of the values
+            sizeof [Optional(callable)]: function returning the size of a
+                value. Defaults to 1 for every value.
+        """
+        self.maxsize = maxsize
+        self.sizeof = sizeof
+        self.size = 0
+        super().__init__()
+
+    def get(self, key, default = None):
+        """ Get a value and mark it as recently used
+        """
+        try:
+            value = self[key]
+        except KeyError:
+            return default
+        self.move_to_end(key)
+        return value
+
+    def __setitem__(self, key, value):
+        if key in self:
+            self.size -= self.sizeof(self[key])
+        super().__setitem__(key, value)
+        self.move_to_end(key)
+        self.size += self.sizeof(value)
+        # evict the least recently used items
+        while self.size > self.maxsize and self:
+            del self[next(iter(self))]
+
+    def __delitem__(self, key):
+        self.size -= self.sizeof(self[key])
+        super().__delitem__(key)
+
+    def clear(self):
+        super().clear()
+        self.size = 0
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# system modules
+import threading
+
+# internal modules
+from . import WithLogger
+
+# background worker class
+class LatestWinsWorker(WithLogger):
+    """ Run jobs one after another in a background thread. Every submitted job
+    gets a new generation number. Only the newest job is kept waiting, older
+    waiting jobs are dropped and results of jobs that were superseded while
+    running are discarded.
+    """
+    def __init__(self, dispatch = None):
+        """ class constructor
+        Args:
+            dispatch [Optional(callable)]: function taking a function to
+                schedule the result callbacks, e.g. GLib.idle_add to run them
+                in the main loop. The scheduled function returns False.
+                Defaults to calling the function directly in the worker thread.
+        """
+        self.dispatch = dispatch if callable(dispatch) else lambda f: f()
+        self.generation = 0
+        self.pending = None # the waiting job
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target = self.work, daemon = True)
+        self.thread.start()
+
+    ### methods ###
+    def submit(self, callback, function, *args, **kwargs):
+        """ Submit a new job, superseding all older ones
+        Args:
+            callback (callable): called with the result of the function via
+                dispatch if the job is still the newest one when it is done
+            function (callable): the function to run in the background
+            args, kwargs: the arguments for the function
+        Returns:
+            generation (int): the generation number of the job
+        """
+        with self.condition:
+            self.generation += 1
+            if self.pending is not None:
+                self.logger.debug(_("Dropping superseded job {}").format(
+                    self.pending[0]))
+            self.pending = (self.generation, callback, function, args, kwargs)
+            self.condition.notify()
+            return self.generation
+
+    def cancel(self):
+        """ Drop the waiting job and discard the result of the running one
+        """
+        with self.condition:
+            self.generation += 1
+            self.pending = None
+
+    def is_current(self, generation):
+        """ Check if a job is still the newest one
+        Args:
+            generation (int): the generation number of the job
+        Returns:
+            current (bool): True if no newer job was submitted
+        """
+        with self.condition:
+            return generation == self.generation
+
+    def work(self):
+        """ Run the waiting jobs forever
+        """
+        while True:
+            with self.condition:
+                while self.pending is None:
+                    self.condition.wait()
+                generation, callback, function, args, kwargs = self.pending
+                self.pending = None
+            try:
+                result = function(*args, **kwargs)
+            except Exception as e:
+                self.logger.warning(_("Background job {} failed: {}").format(
+                    generation, e))
+                result = None
+            if not self.is_current(generation):
+                self.logger.debug(_("Discarding result of superseded job {}"
+                    ).format(generation))
+                continue
+            def deliver(callback = callback, result = result,
+                generation = generation):
+                # a newer job might have been submitted in the meantime
+                if self.is_current(generation):
+                    callback(result)
+                return False
+            self.dispatch(deliver)